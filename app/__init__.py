@@ -2,8 +2,17 @@ import os
 
 from flask import Flask
 
+from app.cache import search_cache, suggest_cache, user_cache
 from app.db import db
+from app.instrumentation import instrumentation
+from app.language_detection import language_detector
+from app.last_seen import last_seen_buffer
+from app.metrics import metrics
+from app.pretranslate import pretranslator
+from app.search import es_service, inverted_index_service
+from app.slow_queries import slow_query_log
 from app.logging_setup import setup_logging
+from app.translate import translator
 from app.extensions import login, mail, moment, babel, get_locale, migrate, es_client
 
 
@@ -19,12 +28,24 @@ def create_app(config_class_name=None) -> Flask:
     login.init_app(app)
     login.login_view = app.config["LOGIN_VIEW"]
     login.login_message = app.config["LOGIN_MESSAGE"]
+    user_cache.configure(app.config["USER_CACHE_SIZE"], app.config["USER_CACHE_TTL"])
+    search_cache.configure(app.config["SEARCH_CACHE_SIZE"], app.config["SEARCH_CACHE_TTL"])
+    suggest_cache.configure(app.config["SUGGEST_CACHE_SIZE"], app.config["SUGGEST_CACHE_TTL"])
 
     mail.init_app(app)
     moment.init_app(app)
     babel.init_app(app, locale_selector=get_locale)
     setup_logging(app)
     es_client.init_app(app)
+    es_service.init_app(app)
+    inverted_index_service.init_app(app)
+    translator.init_app(app)
+    pretranslator.init_app(app)
+    language_detector.init_app(app)
+    last_seen_buffer.init_app(app)
+    instrumentation.init_app(app)
+    metrics.init_app(app)
+    slow_query_log.init_app(app)
 
     from app.errors import bp as errors_bp
     from app.auth import bp as auth_bp
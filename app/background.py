@@ -0,0 +1,68 @@
+import logging
+import os
+import queue
+from threading import Lock, Thread
+from typing import Callable
+
+
+class BackgroundWorker:
+    """A bounded job queue drained by a small pool of daemon threads.
+
+    Threads are started lazily on the first ``submit`` in each process, so a
+    worker created at import time keeps working after gunicorn forks.
+    """
+
+    def __init__(self, name: str, max_queue: int = 1000, num_threads: int = 1) -> None:
+        self.name = name
+        self.max_queue = max_queue
+        self.num_threads = num_threads
+        self.logger = logging.getLogger(f"app.{name}")
+        self._queue = None
+        self._pid = None
+        self._lock = Lock()
+
+    def configure(self, max_queue: int, num_threads: int) -> None:
+        self.max_queue = max_queue
+        self.num_threads = num_threads
+
+    @property
+    def queue_depth(self) -> int:
+        if self._queue is None or self._pid != os.getpid():
+            return 0
+        return self._queue.qsize()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> bool:
+        """Queue ``fn(*args, **kwargs)``; return ``False`` if the queue is full."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((fn, args, kwargs))
+        except queue.Full:
+            return False
+        return True
+
+    def join(self) -> None:
+        """Block until every queued job has run."""
+        if self._queue is not None and self._pid == os.getpid():
+            self._queue.join()
+
+    def _ensure_started(self) -> None:
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            for i in range(self.num_threads):
+                Thread(target=self._run, name=f"{self.name}-{i}", daemon=True).start()
+            self._pid = os.getpid()
+
+    def _run(self) -> None:
+        jobs = self._queue
+        while True:
+            fn, args, kwargs = jobs.get()
+            try:
+                fn(*args, **kwargs)
+            except Exception:  # NOQA
+                self.logger.exception("Background job %s failed", fn)
+            finally:
+                jobs.task_done()
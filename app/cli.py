@@ -1,11 +1,14 @@
 import os
 import click
+import sqlalchemy as sa
 
-from flask import Blueprint
+from flask import Blueprint, current_app
 
-from app.models import Post
+from app.models import Post, PostTranslation, User
 from app.extensions import db
-from app.search import SearchableMixin
+from app.pretranslate import pretranslator
+from app.search import SearchableMixin, drain_search_outbox
+from app.slow_queries import summarize_slow_queries
 
 bp = Blueprint("cli", __name__, cli_group=None)
 
@@ -18,7 +21,19 @@ def translate() -> None:
 
 @bp.cli.group()
 def es_search() -> None:
-    """Elasticsearch search commands."""
+    """Search index commands."""
+    pass
+
+
+@bp.cli.group()
+def users() -> None:
+    """User maintenance commands."""
+    pass
+
+
+@bp.cli.group()
+def slow_queries() -> None:
+    """Slow query log commands."""
     pass
 
 
@@ -53,9 +68,59 @@ def init(lang) -> None:
         os.remove('messages.pot')
 
 
+@translate.command()
+@click.option("--batch-size", default=100, show_default=True,
+              help="Posts translated per upstream request.")
+def posts(batch_size: int) -> None:
+    """Pre-translate the posts that are missing a translation."""
+    if current_app.config.get("MS_TRANSLATOR_KEY") is None:
+        raise click.ClickException("The translation service is not configured.")
+    languages = current_app.config["LANGUAGES"]
+    missing = sa.select(Post.id).where(
+        Post.language != "",
+        sa.select(sa.func.count()).where(
+            PostTranslation.post_id == Post.id,
+            PostTranslation.language.in_(languages)
+        ).scalar_subquery() < sa.case((Post.language.in_(languages), len(languages) - 1),
+                                      else_=len(languages))
+    ).order_by(Post.id)
+    post_ids = db.session.scalars(missing).all()
+    added = 0
+    for start in range(0, len(post_ids), batch_size):
+        added += pretranslator.translate_posts(
+            current_app._get_current_object(), post_ids[start:start + batch_size])
+    click.echo(f"Stored {added} translation(s) for {len(post_ids)} post(s).")
+
+
+@es_search.command()
+@click.option("--workers", default=4, show_default=True,
+              help="Parallel bulk workers.")
+@click.option("--partition-size", default=50000, show_default=True,
+              help="Primary-key range read by each worker task.")
+@click.option("--incremental", is_flag=True,
+              help="Only send rows added since the last checkpoint.")
+@click.option("--chunk-size", default=1000, show_default=True,
+              help="Rows per checkpointed chunk in incremental mode.")
+def reindex(workers: int, partition_size: int, incremental: bool, chunk_size: int) -> None:
+    """Rebuild the posts index and swap it in atomically."""
+    if incremental:
+        sent = Post.reindex_incremental(chunk_size=chunk_size)
+        click.echo(f"Sent {sent} post(s) added since the last checkpoint.")
+        return
+    report = Post.reindex(workers=workers, partition_size=partition_size)
+    if report is not None:
+        click.echo(f"Reindexed posts: {report}")
+
+
 @es_search.command()
-def reindex() -> None:
-    Post.reindex()
+@click.option("--batch-size", default=5000, show_default=True,
+              help="Outbox rows sent per bulk request.")
+@click.option("--max-retries", default=5, show_default=True,
+              help="Retries per batch while the search backend is unavailable.")
+def drain(batch_size: int, max_retries: int) -> None:
+    """Send the index changes waiting in the search outbox."""
+    drained = drain_search_outbox(batch_size=batch_size, max_retries=max_retries)
+    click.echo(f"Sent {drained} document change(s) from the search outbox.")
 
 
 @es_search.command()
@@ -64,3 +129,30 @@ def init_indexes() -> None:
         model_class = model.class_
         if issubclass(model_class, SearchableMixin):
             model_class.create_index()
+
+
+@users.command()
+def recount_follows() -> None:
+    """Recompute follower/following counters and repair any drift."""
+    repaired = User.recount_follows()
+    db.session.commit()
+    click.echo(f"Repaired follow counters for {repaired} user(s).")
+
+
+@slow_queries.command()
+@click.option("--limit", default=10, show_default=True,
+              help="Number of statements to show.")
+def top(limit: int) -> None:
+    """Show the statements with the highest total time in the slow query log."""
+    offenders = summarize_slow_queries(current_app.config["SLOW_QUERY_LOG"], limit)
+    if not offenders:
+        click.echo("No slow queries recorded.")
+    for offender in offenders:
+        click.echo(
+            f"{offender['total_ms']:.1f} ms total | {offender['count']} calls | "
+            f"max {offender['max_ms']:.1f} ms | "
+            f"{', '.join(sorted(offender['endpoints'])) or '-'}"
+        )
+        click.echo(f"  {offender['statement']}")
+        for line in offender["plan"] or []:
+            click.echo(f"    {line}")
@@ -1,4 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import DeclarativeBase
 
 
@@ -7,3 +8,6 @@ class Base(DeclarativeBase):
 
 
 db = SQLAlchemy(model_class=Base)
+
+# Dialects whose INSERT supports ON CONFLICT DO UPDATE.
+UPSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
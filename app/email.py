@@ -4,11 +4,18 @@ from flask import Flask, current_app
 from flask_mail import Message
 
 from app.extensions import mail
+from app.metrics import EMAIL_SEND_DURATION, EMAILS
 
 
 def send_async_email(app: Flask, msg: Message) -> None:
     with app.app_context():
-        mail.send(msg)
+        try:
+            with EMAIL_SEND_DURATION.time():
+                mail.send(msg)
+        except Exception:
+            EMAILS.labels(outcome="error").inc()
+            raise
+        EMAILS.labels(outcome="success").inc()
 
 
 def send_email(
@@ -1,3 +1,5 @@
+import sqlalchemy as sa
+import sqlalchemy.orm as so
 from flask import Flask, current_app, request
 from flask_babel import Babel
 from flask_login import LoginManager
@@ -6,6 +8,7 @@ from flask_moment import Moment
 from flask_migrate import Migrate
 from elasticsearch import Elasticsearch
 
+from app.cache import user_cache
 from app.db import db
 from app.models import User
 
@@ -16,9 +19,34 @@ babel = Babel()
 migrate = Migrate()
 
 
+# Never cached, so a changed password is read from the database when used.
+UNCACHED_USER_COLUMNS = {"password_hash"}
+
+
 @login.user_loader
-def load_user(id_: str) -> User:
-    return db.session.get(User, int(id_))
+def load_user(id_: str) -> User | None:
+    """Load the logged-in user, from ``user_cache`` when possible.
+
+    The cache is per worker: a commit drops the entry only in the worker
+    that made it, so the others may serve the old profile and counters for
+    up to ``USER_CACHE_TTL`` seconds. The password hash is not cached and
+    is loaded on first access.
+    """
+    user_id = int(id_)
+    state = user_cache.get(user_id)
+    if state is not None:
+        user = User(**state)
+        so.make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    user = db.session.get(User, user_id)
+    if user is not None:
+        user_cache.set(user_id, {
+            attr.key: getattr(user, attr.key)
+            for attr in sa.inspect(User).column_attrs
+            if attr.key not in UNCACHED_USER_COLUMNS
+        })
+    return user
 
 
 def get_locale() -> str:
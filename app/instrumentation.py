@@ -0,0 +1,102 @@
+from contextlib import contextmanager
+from time import perf_counter
+
+import sqlalchemy as sa
+from flask import Flask, current_app, g, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+from flask.wrappers import Response
+
+from app.db import db
+
+TIMED_CATEGORIES = ("db", "template", "search", "translate")
+
+
+@contextmanager
+def timed(category: str):
+    """Add the duration of the block to ``category`` of the current request."""
+    if not has_request_context() or "timings" not in g:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        g.timings[category] += perf_counter() - start
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    # Kept on the statement's own context, which is discarded if it raises.
+    context._instrumentation_start_time = perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    if has_request_context() and "timings" in g:
+        g.timings["db"] += perf_counter() - context._instrumentation_start_time
+        g.query_count += 1
+
+
+def _before_render_template(sender: Flask, template, context) -> None:
+    if "timings" in g:
+        g.template_start_time = perf_counter()
+
+
+def _template_rendered(sender: Flask, template, context) -> None:
+    if "timings" in g and "template_start_time" in g:
+        g.timings["template"] += perf_counter() - g.pop("template_start_time")
+
+
+class Instrumentation:
+    """Opt-in per-request timing reported through the ``Server-Timing`` header.
+
+    Enabled with ``INSTRUMENTATION_ENABLED``. Requests issuing more than
+    ``INSTRUMENTATION_QUERY_THRESHOLD`` SQL statements are logged as likely
+    N+1 offenders.
+    """
+
+    def init_app(self, app: Flask) -> None:
+        if not app.config["INSTRUMENTATION_ENABLED"]:
+            return
+        with app.app_context():
+            engine = db.engine
+        if not sa.event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+            sa.event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+            sa.event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        before_render_template.connect(_before_render_template, app)
+        template_rendered.connect(_template_rendered, app)
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+
+    @staticmethod
+    def start_request() -> None:
+        g.request_start_time = perf_counter()
+        g.timings = dict.fromkeys(TIMED_CATEGORIES, 0.0)
+        g.query_count = 0
+
+    @staticmethod
+    def finish_request(response: Response) -> Response:
+        if "timings" not in g:
+            return response
+        total = perf_counter() - g.request_start_time
+        metrics = [f'db;dur={g.timings["db"] * 1000:.1f};desc="{g.query_count} queries"']
+        metrics += [
+            f"{category};dur={g.timings[category] * 1000:.1f}"
+            for category in TIMED_CATEGORIES[1:]
+            if g.timings[category]
+        ]
+        metrics.append(f"total;dur={total * 1000:.1f}")
+        response.headers["Server-Timing"] = ", ".join(metrics)
+
+        current_app.logger.info(
+            "%s %s [%s] %s", request.method, request.path,
+            request.endpoint, ", ".join(metrics)
+        )
+        threshold = current_app.config["INSTRUMENTATION_QUERY_THRESHOLD"]
+        if g.query_count > threshold:
+            current_app.logger.warning(
+                "Possible N+1: %s issued %s SQL statements (threshold %s)",
+                request.endpoint, g.query_count, threshold
+            )
+        return response
+
+
+instrumentation = Instrumentation()
@@ -0,0 +1,101 @@
+import logging
+
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from flask import Flask, current_app
+from langdetect import DetectorFactory, LangDetectException, detect
+from langdetect.detector_factory import init_factory
+
+from app.background import BackgroundWorker
+from app.db import db
+from app.models import Post
+
+
+def load_profiles() -> None:
+    """Load the language profiles once, so no request pays for it.
+
+    The seed makes ``detect`` return the same language for the same text
+    in every worker.
+    """
+    DetectorFactory.seed = 0
+    init_factory()
+
+
+def detect_language(text: str) -> str:
+    try:
+        return detect(text)
+    except LangDetectException:
+        return ""
+
+
+class PostLanguageDetector:
+    """Fills in ``Post.language`` after the post is committed.
+
+    Posts are saved with no language. ``LANGUAGE_DETECTION_MODE`` ``async``
+    hands the posts of each commit to a background worker, ``sync``
+    classifies them right after the commit and ``off`` leaves them unset.
+    Setting the language re-indexes the post and triggers pre-translation.
+    """
+
+    def __init__(self) -> None:
+        self.mode = "async"
+        self.worker = BackgroundWorker("language-detector")
+        self.logger = logging.getLogger("app.language_detection")
+
+    def init_app(self, app: Flask) -> None:
+        self.mode = app.config["LANGUAGE_DETECTION_MODE"]
+        self.worker.configure(
+            max_queue=app.config["LANGUAGE_DETECTION_QUEUE_SIZE"],
+            num_threads=1
+        )
+        load_profiles()
+
+    def after_flush(self, session: so.Session, flush_context) -> None:
+        post_ids = [
+            obj.id for obj in session.new
+            if isinstance(obj, Post) and obj.language is None
+        ]
+        if post_ids:
+            session.info.setdefault("posts_to_detect", set()).update(post_ids)
+
+    def after_commit(self, session: so.Session) -> None:
+        post_ids = session.info.pop("posts_to_detect", None)
+        if post_ids:
+            self.submit(sorted(post_ids))
+
+    def after_rollback(self, session: so.Session) -> None:
+        session.info.pop("posts_to_detect", None)
+
+    def submit(self, post_ids: list[int]) -> None:
+        if self.mode == "off":
+            return
+        app = current_app._get_current_object()
+        if self.mode == "sync":
+            self.detect_languages(app, post_ids)
+        elif not self.worker.submit(self.detect_languages, app, post_ids):
+            self.logger.warning(
+                "Language detection queue is full (%s jobs), detecting in the request.",
+                self.worker.queue_depth
+            )
+            self.detect_languages(app, post_ids)
+
+    def detect_languages(self, app: Flask, post_ids: list[int]) -> int:
+        """Set the language of those of ``post_ids`` that have none; return how many.
+
+        Runs in a fresh application context, and so its own session.
+        """
+        with app.app_context():
+            posts = db.session.scalars(
+                sa.select(Post).where(Post.id.in_(post_ids), Post.language.is_(None))
+            ).all()
+            for post in posts:
+                post.language = detect_language(post.body)
+            db.session.commit()
+            return len(posts)
+
+
+language_detector = PostLanguageDetector()
+
+db.event.listen(db.session, 'after_flush', language_detector.after_flush)
+db.event.listen(db.session, 'after_commit', language_detector.after_commit)
+db.event.listen(db.session, 'after_rollback', language_detector.after_rollback)
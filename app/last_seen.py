@@ -0,0 +1,95 @@
+import atexit
+import logging
+from datetime import datetime
+from threading import Lock
+from time import monotonic
+
+import sqlalchemy as sa
+from flask import Flask
+
+from app.db import db
+from app.models import User
+
+
+class LastSeenBuffer:
+    """Coalesces ``User.last_seen`` updates in memory and writes them in bulk.
+
+    Timestamps are truncated to the minute, so a user browsing for a minute
+    produces a single pending entry. Pending entries are flushed at request
+    teardown once ``LAST_SEEN_FLUSH_INTERVAL`` seconds have passed since the
+    previous flush, in batches of ``LAST_SEEN_BATCH_SIZE`` rows.
+    """
+
+    def __init__(self) -> None:
+        self.flush_interval = 60
+        self.batch_size = 500
+        self.logger = logging.getLogger("app.last_seen")
+        self._pending = {}
+        self._lock = Lock()
+        self._last_flush = monotonic()
+        self._app = None
+
+    def init_app(self, app: Flask) -> None:
+        self.flush_interval = app.config["LAST_SEEN_FLUSH_INTERVAL"]
+        self.batch_size = app.config["LAST_SEEN_BATCH_SIZE"]
+        app.teardown_request(self.flush_if_due)
+        if not app.testing:
+            if self._app is None:
+                atexit.register(self._flush_at_exit)
+            self._app = app
+
+    def record(self, user: User, when: datetime) -> None:
+        minute = when.replace(second=0, microsecond=0)
+        if user.last_seen is not None and \
+                user.last_seen.replace(tzinfo=None) >= minute.replace(tzinfo=None):
+            return
+        with self._lock:
+            pending = self._pending.get(user.id)
+            if pending is None or pending < minute:
+                self._pending[user.id] = minute
+
+    def flush_if_due(self, exc: BaseException | None = None) -> None:
+        if monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = monotonic()
+        if not pending:
+            return 0
+
+        stmt = (
+            sa.update(User.__table__)
+            .where(
+                User.__table__.c.id == sa.bindparam("user_id"),
+                sa.or_(
+                    User.__table__.c.last_seen.is_(None),
+                    User.__table__.c.last_seen < sa.bindparam("seen_at")
+                )
+            )
+            .values(last_seen=sa.bindparam("seen_at"))
+        )
+        rows = [
+            {"user_id": user_id, "seen_at": seen_at}
+            for user_id, seen_at in pending.items()
+        ]
+        try:
+            with db.engine.begin() as connection:
+                for start in range(0, len(rows), self.batch_size):
+                    connection.execute(stmt, rows[start:start + self.batch_size])
+        except sa.exc.SQLAlchemyError:
+            self.logger.exception("Failed to flush %s last_seen updates", len(rows))
+            with self._lock:
+                for user_id, seen_at in pending.items():
+                    if self._pending.get(user_id, seen_at) <= seen_at:
+                        self._pending[user_id] = seen_at
+            return 0
+        return len(rows)
+
+    def _flush_at_exit(self) -> None:
+        with self._app.app_context():
+            self.flush()
+
+
+last_seen_buffer = LastSeenBuffer()
@@ -1,11 +1,11 @@
 from datetime import datetime, timezone
 
 import sqlalchemy as sa
-from flask import render_template, flash, url_for, redirect, request, g, current_app
+import sqlalchemy.orm as so
+from flask import render_template, flash, url_for, redirect, request, g, current_app, abort
 from flask_login import current_user, login_required
 from flask.wrappers import Response
 from flask_babel import _, get_locale  # NOQA
-from langdetect import detect, LangDetectException
 
 from app.main.forms import (
     EditProfileForm,
@@ -13,17 +13,62 @@ from app.main.forms import (
     PostForm,
     SearchForm
 )
+from app.cache import suggest_cache
 from app.db import db
-from app.models import User, Post
-from app.translate import translate
+from app.last_seen import last_seen_buffer
+from app.models import User, Post, timeline
+from app.pagination import keyset_paginate, offset_paginate
+from app.search import load_generation
+from app.translate import translate, translate_batch
 from app.main import bp
 
 
+def paginate_posts(
+        query: sa.Select,
+        order_by: tuple,
+        endpoint: str,
+        **values
+) -> (list, str | None, str | None):
+    per_page = current_app.config["POSTS_PER_PAGE"]
+
+    if current_app.config["FEED_PAGINATION"] == "offset":
+        posts = offset_paginate(
+            query,
+            page=request.args.get("page", 1, type=int),
+            per_page=per_page
+        )
+        next_url = (
+            url_for(endpoint, page=posts.next_num, **values)
+            if posts.has_next else None
+        )
+        prev_url = (
+            url_for(endpoint, page=posts.prev_num, **values)
+            if posts.has_prev else None
+        )
+        return posts.items, next_url, prev_url
+
+    posts = keyset_paginate(
+        query,
+        order_by=order_by,
+        per_page=per_page,
+        after=request.args.get("after"),
+        before=request.args.get("before")
+    )
+    next_url = (
+        url_for(endpoint, after=posts.next_cursor, **values)
+        if posts.has_next else None
+    )
+    prev_url = (
+        url_for(endpoint, before=posts.prev_cursor, **values)
+        if posts.has_prev else None
+    )
+    return posts.items, next_url, prev_url
+
+
 @bp.before_app_request
 def add_last_seen_to_user() -> None:
     if current_user.is_authenticated:
-        current_user.last_seen = datetime.now(timezone.utc)
-        db.session.commit()
+        last_seen_buffer.record(current_user, datetime.now(timezone.utc))
 
 
 @bp.before_app_request
@@ -43,38 +88,23 @@ def add_search_form_to_g() -> None:
 def index() -> str | Response:
     form = PostForm()
     if form.validate_on_submit():
-        try:
-            language = detect(form.post.data)
-        except LangDetectException:
-            language = ""
-
-        post = Post(body=form.post.data, author=current_user, language=language)
+        post = Post(body=form.post.data, author=current_user)
 
         db.session.add(post)
         db.session.commit()
         flash(_("Your post is now live!"))
         return redirect(url_for("main.index"))
 
-    page = request.args.get("page", 1, type=int)
     query = current_user.following_posts()
-    posts = db.paginate(
+    posts, next_url, prev_url = paginate_posts(
         query,
-        page=page,
-        per_page=current_app.config["POSTS_PER_PAGE"],
-        error_out=False
-    )
-    next_url = (
-        url_for("main.index", page=posts.next_num)
-        if posts.has_next else None
-    )
-    prev_url = (
-        url_for("main.index", page=posts.prev_num)
-        if posts.has_prev else None
+        (timeline.c.timestamp, timeline.c.post_id),
+        "main.index"
     )
     return render_template(
         "index.html",
         title="Home",
-        posts=posts.items,
+        posts=posts,
         form=form,
         next_url=next_url,
         prev_url=prev_url
@@ -84,21 +114,15 @@ def index() -> str | Response:
 @bp.route('/explore')
 @login_required
 def explore() -> str:
-    page = request.args.get("page", 1, type=int)
-    query = sa.select(Post).order_by(Post.timestamp.desc())
-    posts = db.paginate(
-        query,
-        page=page,
-        per_page=current_app.config["POSTS_PER_PAGE"],
-        error_out=False
-    )
-    next_url = (
-        url_for("main.explore", page=posts.next_num)
-        if posts.has_next else None
+    query = (
+        sa.select(Post)
+        .options(so.joinedload(Post.author), so.selectinload(Post.translations))
+        .order_by(Post.timestamp.desc(), Post.id.desc())
     )
-    prev_url = (
-        url_for("main.explore", page=posts.prev_num)
-        if posts.has_prev else None
+    posts, next_url, prev_url = paginate_posts(
+        query,
+        (Post.timestamp, Post.id),
+        "main.explore"
     )
     return render_template(
         "index.html",
@@ -117,28 +141,22 @@ def user(username: str) -> str:
     stmt = sa.select(User).where(User.username == username)
     user = db.first_or_404(stmt)
 
-    page = request.args.get("page", 1, type=int)
-
-    query = user.posts.select().order_by(Post.timestamp.desc())
-    posts = db.paginate(
-        query,
-        page=page,
-        per_page=current_app.config["POSTS_PER_PAGE"],
-        error_out=False
+    query = (
+        user.posts.select()
+        .options(so.joinedload(Post.author), so.selectinload(Post.translations))
+        .order_by(Post.timestamp.desc(), Post.id.desc())
     )
-    next_url = (
-        url_for("main.user", username=user.username, page=posts.next_num)
-        if posts.has_next else None
-    )
-    prev_url = (
-        url_for("main.user", username=user.username, page=posts.prev_num)
-        if posts.has_prev else None
+    posts, next_url, prev_url = paginate_posts(
+        query,
+        (Post.timestamp, Post.id),
+        "main.user",
+        username=user.username
     )
 
     return render_template(
         "user.html",
         user=user,
-        posts=posts.items,
+        posts=posts,
         form=form,
         next_url=next_url,
         prev_url=prev_url
@@ -219,8 +237,38 @@ def unfollow(username: str) -> str | Response:
 
 @bp.route("/translate", methods=["POST"])
 @login_required
-def translate_text() -> dict[str, str]:
+def translate_text() -> dict:
+    """Translate one ``text``, or every entry of ``items`` in one go.
+
+    A batch is ``{"items": [{"id", "text", "source_language"}, ...],
+    "dest_language"}`` and is answered with ``{"items": [{"id", "text"}]}``
+    in the same order. A malformed batch is rejected with 400.
+    """
     data = request.get_json()
+    if not isinstance(data, dict):
+        abort(400)
+    if "items" in data:
+        items = data["items"]
+        if not isinstance(items, list) or not isinstance(data.get("dest_language"), str):
+            abort(400)
+        if len(items) > current_app.config["TRANSLATE_BATCH_MAX_ITEMS"]:
+            abort(400)
+        if not all(
+                isinstance(item, dict)
+                and isinstance(item.get("text"), str)
+                and isinstance(item.get("source_language"), str)
+                for item in items):
+            abort(400)
+        translations = translate_batch(
+            [(item["text"], item["source_language"]) for item in items],
+            data["dest_language"]
+        )
+        return {
+            "items": [
+                {"id": item.get("id"), "text": text}
+                for item, text in zip(items, translations)
+            ]
+        }
     return {
         "text": translate(data["text"],
                           data['source_language'],
@@ -234,21 +282,49 @@ def search() -> Response | str:
     if not g.search_form.validate():
         return redirect(url_for("main.index"))
 
-    search_data = g.search_form.q.data
-    page = request.args.get("page", 1, type=int)
-
-    posts, total = Post.search(
-        search_data,
-        page,
-        current_app.config['POSTS_PER_PAGE']
+    posts, total = Post.search_page(
+        g.search_form.q.data,
+        current_app.config['POSTS_PER_PAGE'],
+        after=request.args.get("after"),
+        before=request.args.get("before")
     )
-    next_url = url_for('main.search', q=g.search_form.q.data, page=page + 1) \
-        if total > page * current_app.config['POSTS_PER_PAGE'] else None
-    prev_url = url_for('main.search', q=g.search_form.q.data, page=page - 1) \
-        if page > 1 else None
+    next_url = url_for('main.search', q=g.search_form.q.data, after=posts.next_cursor) \
+        if posts.has_next else None
+    prev_url = url_for('main.search', q=g.search_form.q.data, before=posts.prev_cursor) \
+        if posts.has_prev else None
 
     return render_template(
         "search.html",
         title=_("Search"), posts=posts,
         next_url=next_url, prev_url=prev_url
     )
+
+
+@bp.route("/search/suggest", methods=["GET"])
+@login_required
+def search_suggest() -> dict[str, list]:
+    """Typeahead completions for the navbar search box.
+
+    Responses are cached for ``SUGGEST_CACHE_TTL`` seconds per prefix and
+    post index generation, which is shared by every worker, so repeated
+    keystrokes rarely reach the index and new posts show up at once.
+    """
+    prefix = " ".join(request.args.get("q", "").split())
+    if not prefix:
+        return {"posts": [], "users": []}
+    limit = current_app.config["SUGGEST_LIMIT"]
+    key = (prefix, limit, load_generation(Post.get_index_name()))
+    payload = suggest_cache.get(key)
+    if payload is None:
+        payload = {
+            "posts": [
+                {"id": post.id, "body": post.body, "author": post.author.username}
+                for post in Post.suggest(prefix, limit)
+            ],
+            "users": [
+                {"username": username, "url": url_for("main.user", username=username)}
+                for username in User.suggest_usernames(prefix, limit)
+            ]
+        }
+        suggest_cache.set(key, payload)
+    return payload
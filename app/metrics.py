@@ -0,0 +1,111 @@
+import hmac
+import os
+from time import perf_counter
+
+from flask import Flask, abort, g, request
+from flask.wrappers import Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess
+)
+
+from app.db import db
+
+REQUEST_LATENCY = Histogram(
+    "blog_request_duration_seconds",
+    "Request latency by blueprint and endpoint.",
+    ["blueprint", "endpoint", "method", "status"]
+)
+DB_POOL_CONNECTIONS = Gauge(
+    "blog_db_pool_connections",
+    "Database pool connections by state.",
+    ["state"],
+    multiprocess_mode="livesum"
+)
+SEARCH_OPERATIONS = Counter(
+    "blog_search_operations_total",
+    "Search backend operations by outcome.",
+    ["operation", "outcome"]
+)
+SEARCH_INDEX_QUEUE_DEPTH = Gauge(
+    "blog_search_index_queue_depth",
+    "Bulk indexing jobs waiting for the background search indexer.",
+    multiprocess_mode="livesum"
+)
+TRANSLATIONS = Counter(
+    "blog_translations_total",
+    "Translation requests by outcome.",
+    ["outcome"]
+)
+EMAILS = Counter(
+    "blog_emails_total",
+    "Outgoing emails by outcome.",
+    ["outcome"]
+)
+EMAIL_SEND_DURATION = Histogram(
+    "blog_email_send_duration_seconds",
+    "Time spent handing an email to the SMTP server."
+)
+
+
+class Metrics:
+    """Prometheus metrics for every blueprint, served from ``/metrics``.
+
+    Off unless ``METRICS_ENABLED`` is set; with ``METRICS_TOKEN`` the scraper
+    must send it as a bearer token. When ``PROMETHEUS_MULTIPROC_DIR`` is set
+    (see ``gunicorn.conf.py``) the samples of all gunicorn workers are
+    aggregated from that directory.
+    """
+
+    def __init__(self) -> None:
+        self.token = None
+
+    def init_app(self, app: Flask) -> None:
+        if not app.config["METRICS_ENABLED"]:
+            return
+        self.token = app.config["METRICS_TOKEN"]
+        app.before_request(self.start_request)
+        app.after_request(self.record_request)
+        app.add_url_rule("/metrics", "metrics", self.metrics_view)
+
+    @staticmethod
+    def start_request() -> None:
+        g.metrics_start_time = perf_counter()
+
+    @staticmethod
+    def record_request(response: Response) -> Response:
+        if "metrics_start_time" not in g:
+            return response
+        REQUEST_LATENCY.labels(
+            blueprint=request.blueprint or "",
+            endpoint=request.endpoint or "",
+            method=request.method,
+            status=response.status_code
+        ).observe(perf_counter() - g.metrics_start_time)
+
+        pool = db.engine.pool
+        if hasattr(pool, "checkedout"):
+            DB_POOL_CONNECTIONS.labels(state="checked_out").set(pool.checkedout())
+            DB_POOL_CONNECTIONS.labels(state="checked_in").set(pool.checkedin())
+            DB_POOL_CONNECTIONS.labels(state="overflow").set(max(pool.overflow(), 0))
+        return response
+
+    def metrics_view(self) -> Response:
+        if self.token is not None and not hmac.compare_digest(
+                request.headers.get("Authorization", ""), f"Bearer {self.token}"):
+            abort(401)
+        if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+metrics = Metrics()
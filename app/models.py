@@ -11,6 +11,7 @@ from flask_login import UserMixin
 from flask import current_app
 
 from app import db
+from app.cache import user_cache
 from app.search import SearchableMixin
 
 followers = sa.Table(
@@ -22,6 +23,17 @@ followers = sa.Table(
               primary_key=True)
 )
 
+timeline = sa.Table(
+    'timeline',
+    db.metadata,
+    sa.Column('user_id', sa.Integer, sa.ForeignKey('user.id'),
+              primary_key=True),
+    sa.Column('post_id', sa.Integer, sa.ForeignKey('post.id', ondelete='CASCADE'),
+              primary_key=True),
+    sa.Column('timestamp', sa.DateTime, nullable=False),
+    sa.Index('ix_timeline_user_id_timestamp', 'user_id', 'timestamp')
+)
+
 
 class User(UserMixin, db.Model):
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
@@ -32,6 +44,8 @@ class User(UserMixin, db.Model):
     last_seen: so.Mapped[datetime | None] = so.mapped_column(
         default=lambda: datetime.now(timezone.utc)
     )
+    num_followers: so.Mapped[int] = so.mapped_column(default=0, server_default="0")
+    num_following: so.Mapped[int] = so.mapped_column(default=0, server_default="0")
 
     posts: so.WriteOnlyMapped["Post"] = so.relationship(back_populates="author")
     following: so.WriteOnlyMapped["User"] = so.relationship(
@@ -63,42 +77,115 @@ class User(UserMixin, db.Model):
     def follow(self, user: "User") -> None:
         if not self.is_following(user):
             self.following.add(user)
+            self._update_follow_counts(user, 1)
+            if user.id != self.id:
+                db.session.execute(
+                    sa.insert(timeline).from_select(
+                        ["user_id", "post_id", "timestamp"],
+                        sa.select(sa.literal(self.id), Post.id, Post.timestamp)
+                        .where(Post.user_id == user.id)
+                    )
+                )
 
     def unfollow(self, user: "User") -> None:
         if self.is_following(user):
             self.following.remove(user)
+            self._update_follow_counts(user, -1)
+            if user.id != self.id:
+                db.session.execute(
+                    sa.delete(timeline).where(
+                        timeline.c.user_id == self.id,
+                        timeline.c.post_id.in_(
+                            sa.select(Post.id).where(Post.user_id == user.id)
+                        )
+                    )
+                )
 
     def is_following(self, user: "User") -> bool:
         stmt = self.following.select().where(User.id == user.id)
         return db.session.scalar(stmt) is not None
 
+    def _update_follow_counts(self, user: "User", delta: int) -> None:
+        db.session.info.setdefault("changed_users", set()).update({self.id, user.id})
+        db.session.execute(
+            sa.update(User)
+            .where(User.id == self.id)
+            .values(num_following=User.num_following + delta)
+        )
+        db.session.execute(
+            sa.update(User)
+            .where(User.id == user.id)
+            .values(num_followers=User.num_followers + delta)
+        )
+
     def following_count(self) -> int | None:
-        query = sa.select(sa.func.count()).select_from(
-            self.following.select().subquery())
-        return db.session.scalar(query)
+        return self.num_following
 
     def followers_count(self) -> int | None:
-        query = sa.select(sa.func.count()).select_from(
-            self.followers.select().subquery())
-        return db.session.scalar(query)
+        return self.num_followers
 
-    def following_posts(self):
-        Author = so.aliased(User)  # NOQA
-        Follower = so.aliased(User)  # NOQA
-        return (
-            sa.select(Post)
-            .join(Post.author.of_type(Author))
-            .join(Author.followers.of_type(Follower), isouter=True)
+    @staticmethod
+    def recount_follows() -> int:
+        followers_query = (
+            sa.select(sa.func.count())
+            .where(followers.c.followed_id == User.id)
+            .scalar_subquery()
+        )
+        following_query = (
+            sa.select(sa.func.count())
+            .where(followers.c.follower_id == User.id)
+            .scalar_subquery()
+        )
+        result = db.session.execute(
+            sa.update(User)
             .where(
                 sa.or_(
-                    Follower.id == self.id,
-                    Author.id == self.id,
+                    User.num_followers != followers_query,
+                    User.num_following != following_query
                 )
             )
-            .group_by(Post)
-            .order_by(Post.timestamp.desc())
+            .values(num_followers=followers_query, num_following=following_query)
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount
+
+    @staticmethod
+    def suggest_usernames(prefix: str, limit: int) -> list[str]:
+        """Usernames starting with ``prefix``, read as a range of the username index."""
+        return list(db.session.scalars(
+            sa.select(User.username)
+            .where(User.username >= prefix, User.username < prefix + "\U0010ffff")
+            .order_by(User.username)
+            .limit(limit)
+        ))
+
+    def following_posts(self):
+        return (
+            sa.select(Post)
+            .options(so.joinedload(Post.author), so.selectinload(Post.translations))
+            .join(timeline, timeline.c.post_id == Post.id)
+            .where(timeline.c.user_id == self.id)
+            .order_by(timeline.c.timestamp.desc(), timeline.c.post_id.desc())
         )
 
+    @staticmethod
+    def after_flush(session: so.Session, flush_context) -> None:
+        changed = {
+            obj.id for obj in (*session.dirty, *session.deleted)
+            if isinstance(obj, User)
+        }
+        if changed:
+            session.info.setdefault("changed_users", set()).update(changed)
+
+    @staticmethod
+    def after_commit(session: so.Session) -> None:
+        for user_id in session.info.pop("changed_users", ()):
+            user_cache.pop(user_id)
+
+    @staticmethod
+    def after_rollback(session: so.Session) -> None:
+        session.info.pop("changed_users", None)
+
     def get_reset_password_token(self, expires_in: Optional[int] = None) -> str:
         if expires_in is None:
             expires_in = current_app.config["JWT_EXPIRES_IN"]
@@ -123,6 +210,9 @@ class User(UserMixin, db.Model):
 
 class Post(db.Model, SearchableMixin):
     searchable_fields = ["body"]
+    search_eager_load = ["author", "translations"]
+    search_language_field = "language"
+    suggest_fields = ["body"]
 
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
     body: so.Mapped[str] = so.mapped_column(sa.String(140))
@@ -134,10 +224,80 @@ class Post(db.Model, SearchableMixin):
     language: so.Mapped[Optional[str]] = so.mapped_column(sa.String(5))
 
     author: so.Mapped[User] = so.relationship(back_populates="posts")
+    translations: so.Mapped[list["PostTranslation"]] = so.relationship(
+        back_populates="post", passive_deletes="all")
 
     def __repr__(self) -> str:
         return f"<Post {self.body}>"
 
+    def translated_body(self, language: str) -> str | None:
+        """The stored translation into ``language``, if pre-translation made one."""
+        for translation in self.translations:
+            if translation.language == language:
+                return translation.body
+        return None
+
+    @staticmethod
+    def before_flush(session: so.Session, flush_context, instances) -> None:
+        deleted_ids = [
+            obj.id for obj in session.deleted if isinstance(obj, Post)
+        ]
+        if deleted_ids:
+            session.connection().execute(
+                sa.delete(timeline).where(timeline.c.post_id.in_(deleted_ids))
+            )
+            session.connection().execute(
+                sa.delete(PostTranslation.__table__)
+                .where(PostTranslation.__table__.c.post_id.in_(deleted_ids))
+            )
+
+    @staticmethod
+    def after_flush(session: so.Session, flush_context) -> None:
+        new_posts = [obj for obj in session.new if isinstance(obj, Post)]
+        if not new_posts:
+            return
+        connection = session.connection()
+        connection.execute(
+            sa.insert(timeline),
+            [
+                {"user_id": post.user_id, "post_id": post.id,
+                 "timestamp": post.timestamp}
+                for post in new_posts
+            ]
+        )
+        for post in new_posts:
+            connection.execute(
+                sa.insert(timeline).from_select(
+                    ["user_id", "post_id", "timestamp"],
+                    sa.select(
+                        followers.c.follower_id,
+                        sa.literal(post.id),
+                        sa.literal(post.timestamp, sa.DateTime)
+                    ).where(
+                        followers.c.followed_id == post.user_id,
+                        followers.c.follower_id != post.user_id
+                    )
+                )
+            )
+
+
+class PostTranslation(db.Model):
+    post_id: so.Mapped[int] = so.mapped_column(
+        sa.ForeignKey(Post.id, ondelete="CASCADE"), primary_key=True)
+    language: so.Mapped[str] = so.mapped_column(sa.String(5), primary_key=True)
+    body: so.Mapped[str] = so.mapped_column(sa.Text)
+
+    post: so.Mapped[Post] = so.relationship(back_populates="translations")
+
+    def __repr__(self) -> str:
+        return f"<PostTranslation {self.post_id} {self.language}>"
+
 
-db.event.listen(db.session, 'before_commit', SearchableMixin.before_commit)
+db.event.listen(db.session, 'after_flush', User.after_flush)
+db.event.listen(db.session, 'after_commit', User.after_commit)
+db.event.listen(db.session, 'after_rollback', User.after_rollback)
+db.event.listen(db.session, 'before_flush', Post.before_flush)
+db.event.listen(db.session, 'after_flush', Post.after_flush)
+db.event.listen(db.session, 'after_flush', SearchableMixin.after_flush)
 db.event.listen(db.session, 'after_commit', SearchableMixin.after_commit)
+db.event.listen(db.session, 'after_rollback', SearchableMixin.after_rollback)
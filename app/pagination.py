@@ -0,0 +1,166 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from app.db import db
+
+
+class KeysetPagination:
+    """A page of posts addressed by opaque ``after``/``before`` cursors.
+
+    Items must expose ``timestamp`` and ``id`` attributes matching the
+    ``order_by`` columns the page was selected with.
+    """
+
+    def __init__(
+            self,
+            items: list,
+            next_cursor: str | None = None,
+            prev_cursor: str | None = None
+    ) -> None:
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self) -> bool:
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+class OffsetPagination:
+    """A numbered page that never runs ``COUNT(*)`` to find out if more follow."""
+
+    def __init__(
+            self,
+            items: list,
+            page: int,
+            per_page: int,
+            has_next: bool
+    ) -> None:
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.has_next = has_next
+
+    @property
+    def has_prev(self) -> bool:
+        return self.page > 1
+
+    @property
+    def next_num(self) -> int | None:
+        return self.page + 1 if self.has_next else None
+
+    @property
+    def prev_num(self) -> int | None:
+        return self.page - 1 if self.has_prev else None
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+def offset_paginate(query: sa.Select, page: int, per_page: int) -> OffsetPagination:
+    """Select page ``page`` of ``query`` reading ``per_page + 1`` rows."""
+    page = max(page, 1)
+    items = db.session.scalars(
+        query.limit(per_page + 1).offset((page - 1) * per_page)
+    ).all()
+    return OffsetPagination(
+        items=items[:per_page],
+        page=page,
+        per_page=per_page,
+        has_next=len(items) > per_page
+    )
+
+
+def encode_token(payload) -> str:
+    """Pack a JSON-serializable ``payload`` into an opaque, URL-safe cursor."""
+    data = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def decode_token(cursor: str | None):
+    """Unpack a cursor made by ``encode_token``; ``None`` if it is missing or invalid."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded))
+    except (binascii.Error, ValueError):
+        return None
+
+
+def encode_cursor(timestamp: datetime, id_: int) -> str:
+    return encode_token([timestamp.isoformat(), id_])
+
+
+def decode_cursor(cursor: str | None) -> tuple[datetime, int] | None:
+    try:
+        timestamp, id_ = decode_token(cursor)
+        return datetime.fromisoformat(timestamp), int(id_)
+    except (ValueError, TypeError):
+        return None
+
+
+def keyset_paginate(
+        query: sa.Select,
+        order_by: tuple,
+        per_page: int,
+        after: str | None = None,
+        before: str | None = None
+) -> KeysetPagination:
+    """Select one page of ``query`` newest first, keyed on ``order_by``.
+
+    ``order_by`` is a ``(timestamp_column, id_column)`` pair; any ordering
+    already present on ``query`` is replaced. ``after`` walks towards older
+    rows and ``before`` towards newer ones. Invalid cursors fall back to the
+    first page. Only ``per_page + 1`` rows are read, whatever the depth.
+    """
+    timestamp_column, id_column = order_by
+    query = query.order_by(None)
+
+    cursor = decode_cursor(before)
+    if cursor is not None:
+        timestamp, id_ = cursor
+        query = query.where(
+            sa.or_(
+                timestamp_column > timestamp,
+                sa.and_(timestamp_column == timestamp, id_column > id_)
+            )
+        ).order_by(timestamp_column.asc(), id_column.asc())
+        items = db.session.scalars(query.limit(per_page + 1)).all()
+        has_prev = len(items) > per_page
+        items = list(reversed(items[:per_page]))
+        return KeysetPagination(
+            items,
+            next_cursor=encode_cursor(items[-1].timestamp, items[-1].id) if items else None,
+            prev_cursor=encode_cursor(items[0].timestamp, items[0].id) if has_prev else None
+        )
+
+    cursor = decode_cursor(after)
+    if cursor is not None:
+        timestamp, id_ = cursor
+        query = query.where(
+            sa.or_(
+                timestamp_column < timestamp,
+                sa.and_(timestamp_column == timestamp, id_column < id_)
+            )
+        )
+    query = query.order_by(timestamp_column.desc(), id_column.desc())
+    items = db.session.scalars(query.limit(per_page + 1)).all()
+    has_next = len(items) > per_page
+    items = items[:per_page]
+    return KeysetPagination(
+        items,
+        next_cursor=encode_cursor(items[-1].timestamp, items[-1].id) if has_next else None,
+        prev_cursor=encode_cursor(items[0].timestamp, items[0].id) if cursor and items else None
+    )
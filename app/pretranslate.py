@@ -0,0 +1,104 @@
+import logging
+
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from flask import Flask, current_app
+
+from app.background import BackgroundWorker
+from app.db import db
+from app.models import Post, PostTranslation
+from app.translate import TranslationError, lookup_translations
+
+
+class PostPreTranslator:
+    """Translates committed posts into the other ``LANGUAGES`` ahead of reading.
+
+    ``PRETRANSLATE_MODE`` ``async`` hands the posts of each commit to a
+    background worker, ``sync`` translates them right after the commit and
+    ``off`` leaves translation to the readers. Nothing is queued while the
+    translator is not configured. Posts whose translation fails keep the
+    on-demand "Translate" link.
+    """
+
+    def __init__(self) -> None:
+        self.mode = "async"
+        self.worker = BackgroundWorker("post-translator")
+        self.logger = logging.getLogger("app.pretranslate")
+
+    def init_app(self, app: Flask) -> None:
+        self.mode = app.config["PRETRANSLATE_MODE"]
+        self.worker.configure(
+            max_queue=app.config["PRETRANSLATE_QUEUE_SIZE"],
+            num_threads=1
+        )
+
+    def enabled(self) -> bool:
+        return self.mode != "off" and current_app.config.get("MS_TRANSLATOR_KEY") is not None
+
+    def after_flush(self, session: so.Session, flush_context) -> None:
+        post_ids = [
+            obj.id for obj in (*session.new, *session.dirty)
+            if isinstance(obj, Post) and obj.language
+            and sa.inspect(obj).attrs.language.history.has_changes()
+        ]
+        if post_ids:
+            session.info.setdefault("posts_to_translate", set()).update(post_ids)
+
+    def after_commit(self, session: so.Session) -> None:
+        post_ids = session.info.pop("posts_to_translate", None)
+        if post_ids:
+            self.submit(sorted(post_ids))
+
+    def after_rollback(self, session: so.Session) -> None:
+        session.info.pop("posts_to_translate", None)
+
+    def submit(self, post_ids: list[int]) -> None:
+        if not self.enabled():
+            return
+        app = current_app._get_current_object()
+        if self.mode == "sync":
+            self.translate_posts(app, post_ids)
+        elif not self.worker.submit(self.translate_posts, app, post_ids):
+            self.logger.warning(
+                "Pre-translation queue is full (%s jobs), skipping posts %s.",
+                self.worker.queue_depth, post_ids
+            )
+
+    def translate_posts(self, app: Flask, post_ids: list[int]) -> int:
+        """Store the missing translations of ``post_ids``; return how many were added.
+
+        Runs in a fresh application context, and so its own session.
+        """
+        with app.app_context():
+            posts = db.session.scalars(
+                sa.select(Post)
+                .options(so.selectinload(Post.translations))
+                .where(Post.id.in_(post_ids), Post.language != "")
+            ).all()
+            added = 0
+            for language in app.config["LANGUAGES"]:
+                pending = [
+                    post for post in posts
+                    if post.language != language and post.translated_body(language) is None
+                ]
+                if not pending:
+                    continue
+                results = lookup_translations(
+                    [(post.body, post.language) for post in pending], language)
+                for post, result in zip(pending, results):
+                    if isinstance(result, TranslationError):
+                        self.logger.warning("Could not pre-translate post %s into %s: %s",
+                                            post.id, language, result.reason)
+                        continue
+                    db.session.add(PostTranslation(
+                        post_id=post.id, language=language, body=result))
+                    added += 1
+            db.session.commit()
+            return added
+
+
+pretranslator = PostPreTranslator()
+
+db.event.listen(db.session, 'after_flush', pretranslator.after_flush)
+db.event.listen(db.session, 'after_commit', pretranslator.after_commit)
+db.event.listen(db.session, 'after_rollback', pretranslator.after_rollback)
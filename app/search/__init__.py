@@ -0,0 +1,17 @@
+from app.search.backend import (
+    SearchBackend,
+    bump_generations,
+    load_generation,
+    search_checkpoint,
+    search_generation,
+    search_outbox
+)
+from app.search.database import DatabaseSearchService, db_search_service
+from app.search.elasticsearch import BulkReport, ElasticsearchService, es_service
+from app.search.inverted import InvertedIndexService, inverted_index_service
+from app.search.mixin import (
+    SearchableMixin,
+    drain_search_outbox,
+    get_search_backend,
+    search_backends
+)
@@ -0,0 +1,161 @@
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from flask import Flask
+
+from app.db import UPSERTS, db
+from app.metrics import SEARCH_OPERATIONS
+from app.pagination import decode_token, encode_token
+
+search_outbox = sa.Table(
+    'search_outbox',
+    db.metadata,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('index_name', sa.String(64), nullable=False),
+    sa.Column('doc_id', sa.Integer, nullable=False),
+    sa.Column('op_type', sa.String(10), nullable=False),
+    sa.Column('created_at', sa.DateTime, nullable=False,
+              default=lambda: datetime.now(timezone.utc))
+)
+
+search_checkpoint = sa.Table(
+    'search_checkpoint',
+    db.metadata,
+    sa.Column('index_name', sa.String(64), primary_key=True),
+    sa.Column('last_id', sa.Integer, nullable=False),
+    sa.Column('updated_at', sa.DateTime, nullable=False,
+              default=lambda: datetime.now(timezone.utc),
+              onupdate=lambda: datetime.now(timezone.utc))
+)
+
+search_generation = sa.Table(
+    'search_generation',
+    db.metadata,
+    sa.Column('index_name', sa.String(64), primary_key=True),
+    sa.Column('generation', sa.Integer, nullable=False)
+)
+
+
+def load_generation(index_name: str) -> int:
+    """Return the generation of ``index_name`` as every worker sees it."""
+    return db.session.scalar(
+        sa.select(search_generation.c.generation)
+        .where(search_generation.c.index_name == index_name)
+    ) or 0
+
+
+def bump_generations(connection: sa.Connection, index_names) -> None:
+    """Advance the generation of ``index_names`` within ``connection``'s transaction.
+
+    Cached search results are keyed on the generation, so the bump makes
+    them stale in every worker once the transaction commits.
+    """
+    rows = [{"index_name": index_name, "generation": 1} for index_name in sorted(index_names)]
+    if not rows:
+        return
+    insert = UPSERTS.get(connection.dialect.name)
+    if insert is not None:
+        statement = insert(search_generation)
+        connection.execute(
+            statement.on_conflict_do_update(
+                index_elements=[search_generation.c.index_name],
+                set_={"generation": search_generation.c.generation + 1}
+            ),
+            rows
+        )
+        return
+    for row in rows:
+        updated = connection.execute(
+            sa.update(search_generation)
+            .where(search_generation.c.index_name == row["index_name"])
+            .values(generation=search_generation.c.generation + 1)
+        ).rowcount
+        if not updated:
+            connection.execute(sa.insert(search_generation).values(**row))
+
+
+class SearchBackend:
+    """The operations ``SearchableMixin`` needs from a search implementation.
+
+    Documents travel as Elasticsearch-style bulk actions: ``{"_index",
+    "_id", "_source"}`` for an upsert and ``{"_op_type": "delete", "_index",
+    "_id"}`` for a removal.
+    """
+
+    def init_app(self, app: Flask) -> None:
+        pass
+
+    @staticmethod
+    @contextmanager
+    def track(operation: str):
+        try:
+            yield
+        except Exception:
+            SEARCH_OPERATIONS.labels(operation=operation, outcome="error").inc()
+            raise
+        SEARCH_OPERATIONS.labels(operation=operation, outcome="success").inc()
+
+    def create_index(
+            self,
+            index_name: str,
+            fields: list[str],
+            suggest_fields: list[str] = ()
+    ) -> None:
+        raise NotImplementedError
+
+    def indexing_enabled(self) -> bool:
+        return True
+
+    def query_index(self, index: str, query: str, page: int, per_page: int) -> (list[int], int):
+        raise NotImplementedError
+
+    def query_index_cursor(
+            self,
+            index: str,
+            query: str,
+            per_page: int,
+            after: str | None = None,
+            before: str | None = None
+    ) -> (list[int], int, str | None, str | None):
+        """Return a page of ids, the total and the next and previous cursors.
+
+        Backends without native cursors encode the page number in them.
+        """
+        cursor = decode_token(after or before)
+        page = cursor.get("page") if isinstance(cursor, dict) else None
+        if not isinstance(page, int) or page < 1:
+            page = 1
+        ids, total = self.query_index(index, query, page, per_page)
+        next_cursor = encode_token({"page": page + 1}) if total > page * per_page else None
+        prev_cursor = encode_token({"page": page - 1}) if page > 1 else None
+        return ids, total, next_cursor, prev_cursor
+
+    def suggest(self, index: str, prefix: str, fields: list[str], limit: int) -> list[int]:
+        """Return the ids of up to ``limit`` documents completing ``prefix``.
+
+        The last word of ``prefix`` may be incomplete; the earlier ones must
+        match whole terms.
+        """
+        raise NotImplementedError
+
+    def bulk(self, actions: list[dict]) -> set[tuple[str, str]] | None:
+        """Apply ``actions`` and return the ``(index, id)`` keys that failed.
+
+        ``None`` means the backend could not be reached at all.
+        """
+        raise NotImplementedError
+
+    def on_flush(self, session: so.Session, actions: list[dict]) -> None:
+        """Called with the index changes of every flush, inside its transaction."""
+        raise NotImplementedError
+
+    def on_commit(self, session: so.Session) -> None:
+        pass
+
+    def on_rollback(self, session: so.Session) -> None:
+        pass
+
+    def reindex(self, model: type, workers: int, partition_size: int):
+        raise NotImplementedError
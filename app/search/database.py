@@ -0,0 +1,189 @@
+import logging
+import re
+
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+
+from app.db import db
+from app.instrumentation import timed
+from app.search.backend import SearchBackend
+
+SUPPORTED_DIALECTS = ("sqlite", "postgresql")
+
+
+class DatabaseSearchService(SearchBackend):
+    """Full-text search inside the application database.
+
+    SQLite uses an FTS5 virtual table whose rowid is the document id, and
+    Postgres a ``tsvector`` column with a GIN index. Index changes are
+    written in the same transaction as the rows they describe.
+    """
+
+    def __init__(self) -> None:
+        self.logger = logging.getLogger("app.search")
+
+    @staticmethod
+    def table_name(index: str) -> str:
+        return f"{index}_search"
+
+    def create_index(
+            self,
+            index_name: str,
+            fields: list[str],
+            suggest_fields: list[str] = (),
+            connection: sa.Connection | None = None
+    ) -> None:
+        if connection is None:
+            with db.engine.begin() as connection:
+                return self.create_index(index_name, fields, connection=connection)
+
+        table = self.table_name(index_name)
+        dialect = connection.dialect.name
+        if dialect == "sqlite":
+            connection.exec_driver_sql(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5("
+                f"{', '.join(fields)}, tokenize='unicode61 remove_diacritics 2')"
+            )
+        elif dialect == "postgresql":
+            connection.exec_driver_sql(
+                f"CREATE TABLE IF NOT EXISTS {table} "
+                f"(doc_id INTEGER PRIMARY KEY, document TSVECTOR NOT NULL)"
+            )
+            connection.exec_driver_sql(
+                f"CREATE INDEX IF NOT EXISTS ix_{table}_document "
+                f"ON {table} USING GIN (document)"
+            )
+        else:
+            self.logger.warning("Database search is not supported on %s.", dialect)
+
+    @staticmethod
+    def match_expression(query: str) -> str:
+        """Turn free text into an OR of quoted terms, like ``multi_match`` does."""
+        terms = re.findall(r"\w+", query)
+        return " OR ".join(f'"{term}"' for term in terms)
+
+    def query_index(self, index: str, query: str, page: int, per_page: int) -> (list[int], int):
+        dialect = db.engine.dialect.name
+        expression = self.match_expression(query)
+        if dialect not in SUPPORTED_DIALECTS or not expression:
+            return [], 0
+
+        table = self.table_name(index)
+        params = {"query": expression, "limit": per_page, "offset": (page - 1) * per_page}
+        if dialect == "sqlite":
+            ids_query = sa.text(
+                f"SELECT rowid FROM {table} WHERE {table} MATCH :query "
+                f"ORDER BY rank LIMIT :limit OFFSET :offset"
+            )
+            total_query = sa.text(f"SELECT count(*) FROM {table} WHERE {table} MATCH :query")
+        else:
+            tsquery = "websearch_to_tsquery('simple', :query)"
+            ids_query = sa.text(
+                f"SELECT doc_id FROM {table} WHERE document @@ {tsquery} "
+                f"ORDER BY ts_rank(document, {tsquery}) DESC, doc_id "
+                f"LIMIT :limit OFFSET :offset"
+            )
+            total_query = sa.text(f"SELECT count(*) FROM {table} WHERE document @@ {tsquery}")
+
+        with timed("search"), self.track("query"):
+            ids = list(db.session.scalars(ids_query, params))
+            total = db.session.scalar(total_query, params) if ids or page > 1 else 0
+        return ids, total
+
+    def suggest(self, index: str, prefix: str, fields: list[str], limit: int) -> list[int]:
+        """Use FTS5 prefix queries on SQLite and ``:*`` tsquery prefixes on Postgres."""
+        dialect = db.engine.dialect.name
+        terms = re.findall(r"\w+", prefix)
+        if dialect not in SUPPORTED_DIALECTS or not terms:
+            return []
+
+        table = self.table_name(index)
+        if dialect == "sqlite":
+            expression = " ".join(f'"{term}"' for term in terms) + "*"
+            query = sa.text(
+                f"SELECT rowid FROM {table} WHERE {table} MATCH :query "
+                f"ORDER BY rank LIMIT :limit"
+            )
+        else:
+            expression = " & ".join(terms) + ":*"
+            tsquery = "to_tsquery('simple', :query)"
+            query = sa.text(
+                f"SELECT doc_id FROM {table} WHERE document @@ {tsquery} "
+                f"ORDER BY ts_rank(document, {tsquery}) DESC LIMIT :limit"
+            )
+        with timed("search"), self.track("suggest"):
+            return list(db.session.scalars(query, {"query": expression, "limit": limit}))
+
+    def apply(self, connection: sa.Connection, actions: list[dict]) -> None:
+        dialect = connection.dialect.name
+        if dialect not in SUPPORTED_DIALECTS:
+            return
+        key = "rowid" if dialect == "sqlite" else "doc_id"
+        by_index = {}
+        for action in actions:
+            by_index.setdefault(action["_index"], {})[action["_id"]] = action
+
+        for index, latest in by_index.items():
+            table = self.table_name(index)
+            connection.execute(
+                sa.text(f"DELETE FROM {table} WHERE {key} = :id"),
+                [{"id": doc_id} for doc_id in latest]
+            )
+            documents = [
+                action for action in latest.values()
+                if action.get("_op_type", "index") == "index"
+            ]
+            if not documents:
+                continue
+            fields = list(documents[0]["_source"])
+            if dialect == "sqlite":
+                statement = sa.text(
+                    f"INSERT INTO {table} (rowid, {', '.join(fields)}) "
+                    f"VALUES (:id, {', '.join(':' + field for field in fields)})"
+                )
+                rows = [{"id": action["_id"], **action["_source"]} for action in documents]
+            else:
+                statement = sa.text(
+                    f"INSERT INTO {table} (doc_id, document) "
+                    f"VALUES (:id, to_tsvector('simple', :text))"
+                )
+                rows = [
+                    {"id": action["_id"],
+                     "text": " ".join(str(value) for value in action["_source"].values()
+                                      if value is not None)}
+                    for action in documents
+                ]
+            connection.execute(statement, rows)
+
+    def on_flush(self, session: so.Session, actions: list[dict]) -> None:
+        self.apply(session.connection(), actions)
+
+    def bulk(self, actions: list[dict]) -> set[tuple[str, str]] | None:
+        with db.engine.begin() as connection:
+            self.apply(connection, actions)
+        return set()
+
+    def reindex(self, model: type, workers: int = 4, partition_size: int = 50000) -> None:
+        """Rebuild the table from the model's rows in a single transaction."""
+        table = self.table_name(model.get_index_name())
+        fields = model.searchable_fields
+        with db.engine.begin() as connection:
+            self.create_index(model.get_index_name(), fields, connection=connection)
+            dialect = connection.dialect.name
+            if dialect not in SUPPORTED_DIALECTS:
+                return
+            connection.exec_driver_sql(f"DELETE FROM {table}")
+            if dialect == "sqlite":
+                connection.exec_driver_sql(
+                    f"INSERT INTO {table} (rowid, {', '.join(fields)}) "
+                    f"SELECT id, {', '.join(fields)} FROM {model.__tablename__}"
+                )
+            else:
+                connection.exec_driver_sql(
+                    f"INSERT INTO {table} (doc_id, document) "
+                    f"SELECT id, to_tsvector('simple', concat_ws(' ', {', '.join(fields)})) "
+                    f"FROM {model.__tablename__}"
+                )
+
+
+db_search_service = DatabaseSearchService()
@@ -0,0 +1,630 @@
+import json
+import logging
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from time import perf_counter
+from typing import Iterable
+
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from flask import Flask, current_app
+from elasticsearch import (
+    ConnectionError,
+    Elasticsearch,
+    ElasticsearchException,
+    NotFoundError,
+    TransportError,
+    helpers
+)
+
+from app.background import BackgroundWorker
+from app.db import db
+from app.instrumentation import timed
+from app.metrics import SEARCH_INDEX_QUEUE_DEPTH
+from app.pagination import decode_token, encode_token
+from app.search.backend import SearchBackend, bump_generations, search_outbox
+
+
+BULK_METADATA_BYTES = 100
+BULK_MIN_CHUNK_BYTES = 64 * 1024
+BULK_INITIAL_BACKOFF = 0.5
+BULK_MAX_BACKOFF = 30.0
+REJECTED_STATUSES = (429, 503)
+
+
+class BulkReport:
+    """Outcome of a bulk indexing run."""
+
+    def __init__(self) -> None:
+        self.indexed = 0
+        self.failed = 0
+        self.retried = 0
+        self.seconds = 0.0
+
+    @property
+    def docs_per_second(self) -> float:
+        return self.indexed / self.seconds if self.seconds else 0.0
+
+    def merge(self, other: "BulkReport") -> None:
+        self.indexed += other.indexed
+        self.failed += other.failed
+        self.retried += other.retried
+
+    def __str__(self) -> str:
+        return (f"{self.indexed} indexed, {self.failed} failed, {self.retried} retried "
+                f"in {self.seconds:.1f}s ({self.docs_per_second:.0f} docs/s)")
+
+
+class ElasticsearchService(SearchBackend):
+    def __init__(self, es_client=None) -> None:
+        self.es_client = es_client
+        self.logger = logging.getLogger("app.elasticsearch")
+        self.indexing_mode = "async"
+        self.indexing_worker = BackgroundWorker("search-indexer")
+        self.track_total_hits = 1000
+        self.pit_keep_alive = "5m"
+        self.pit_supported = None
+        self.bulk_max_chunk_bytes = 10 * 1024 * 1024
+        self.bulk_max_retries = 5
+        self.bulk_threads = 1
+
+    def init_app(self, app: Flask) -> None:
+        self.indexing_mode = app.config["SEARCH_INDEXING_MODE"]
+        self.track_total_hits = app.config["SEARCH_TRACK_TOTAL_HITS"]
+        self.pit_keep_alive = app.config["SEARCH_PIT_KEEP_ALIVE"]
+        self.pit_supported = None
+        self.bulk_max_chunk_bytes = app.config["SEARCH_BULK_MAX_CHUNK_BYTES"]
+        self.bulk_max_retries = app.config["SEARCH_BULK_MAX_RETRIES"]
+        self.bulk_threads = app.config["SEARCH_BULK_THREADS"]
+        self.indexing_worker.configure(
+            max_queue=app.config["SEARCH_INDEXING_QUEUE_SIZE"],
+            num_threads=app.config["SEARCH_INDEXING_WORKERS"]
+        )
+
+    def get_es_client(self) -> Elasticsearch | None:
+        if self.es_client is None:
+            self.es_client = current_app.elasticsearch
+        return self.es_client
+
+    @staticmethod
+    def versioned_index_name(alias: str) -> str:
+        return f"{alias}-{datetime.now(timezone.utc):%Y%m%d%H%M%S%f}"
+
+    @staticmethod
+    def index_body(suggest_fields: list[str] = ()) -> dict:
+        """Settings for a new index; ``suggest_fields`` get edge n-gram subfields."""
+        return {
+            "mappings": {
+                "properties": {
+                    field: {"type": "search_as_you_type"}
+                    for field in suggest_fields
+                }
+            }
+        }
+
+    def create_index(
+            self,
+            index_name: str,
+            fields: list[str] | None = None,
+            suggest_fields: list[str] = ()
+    ) -> None:
+        """Create a versioned index behind the ``index_name`` alias if missing."""
+        es_client = self.get_es_client()
+        if es_client is None:
+            return None
+        if not es_client.indices.exists(index=index_name):
+            versioned_index = self.versioned_index_name(index_name)
+            es_client.indices.create(
+                index=versioned_index,
+                body={"aliases": {index_name: {}}, **self.index_body(suggest_fields)}
+            )
+            self.logger.info("Index [%s] created for alias [%s].", versioned_index, index_name)
+
+    def swap_alias(self, alias: str, new_index: str) -> None:
+        """Atomically point ``alias`` at ``new_index`` and drop the old indices."""
+        es_client = self.get_es_client()
+        actions = [{"add": {"index": new_index, "alias": alias}}]
+        old_indices = []
+        if es_client.indices.exists_alias(name=alias):
+            old_indices = list(es_client.indices.get_alias(name=alias))
+            actions += [{"remove": {"index": index, "alias": alias}}
+                        for index in old_indices]
+        elif es_client.indices.exists(index=alias):
+            # Indices created before aliases were used carry the alias name.
+            actions.append({"remove_index": {"index": alias}})
+        es_client.indices.update_aliases(body={"actions": actions})
+        self.logger.info("Alias [%s] now points to [%s].", alias, new_index)
+        for index in old_indices:
+            es_client.indices.delete(index=index, ignore=[404])
+
+    def add_to_index(self, index: str, doc_id: int, document: dict) -> None:
+        es_client = self.get_es_client()
+        if es_client is None:
+            return
+        with timed("search"), self.track("index"):
+            es_client.index(index=index, id=doc_id, body=document)
+
+    def remove_from_index(self, index: str, doc_id: int) -> None:
+        es_client = self.get_es_client()
+        if es_client is None:
+            return
+        with timed("search"), self.track("delete"):
+            es_client.delete(index=index, id=doc_id, ignore=[404])
+
+    def indexing_enabled(self) -> bool:
+        return self.indexing_mode != "off" and self.get_es_client() is not None
+
+    def bulk(
+            self,
+            actions: list[dict],
+            es_client: Elasticsearch | None = None
+    ) -> set[tuple[str, str]] | None:
+        """Send ``actions`` in one request.
+
+        Return the ``(index, id)`` keys of the actions that failed, or
+        ``None`` when the request itself failed.
+        """
+        es_client = es_client or self.get_es_client()
+        if es_client is None:
+            return None
+        try:
+            with timed("search"), self.track("bulk"):
+                _, errors = helpers.bulk(es_client, actions, raise_on_error=False)
+        except ElasticsearchException:
+            self.logger.exception("Bulk request with %s actions failed", len(actions))
+            return None
+        finally:
+            SEARCH_INDEX_QUEUE_DEPTH.set(self.indexing_worker.queue_depth)
+        # Errors come back in request order, but name the concrete index
+        # behind the alias, so each one is matched to the next action with
+        # its id and reported under that action's own index.
+        failed = set()
+        pending = iter(actions)
+        for error in errors:
+            op_type, response = next(iter(error.items()))
+            action = next(
+                (action for action in pending
+                 if str(action["_id"]) == str(response.get("_id"))
+                 and action.get("_op_type", "index") == op_type),
+                {"_index": response.get("_index")}
+            )
+            if op_type == "delete" and response.get("status") == 404:
+                continue
+            failed.add((action["_index"], str(response.get("_id"))))
+            self.logger.error(
+                "Failed to %s doc %s | status=%s | error=%s",
+                op_type, response.get("_id"), response.get("status"),
+                response.get("error")
+            )
+        return failed
+
+    def index_and_acknowledge(
+            self,
+            app: Flask,
+            es_client: Elasticsearch,
+            actions: list[dict],
+            outbox_ids: list[int]
+    ) -> None:
+        """Send ``actions`` and remove the outbox rows of those that succeeded.
+
+        The index generations are bumped again once the documents are in
+        Elasticsearch, dropping results cached while they were queued.
+        """
+        failed = self.bulk(actions, es_client)
+        if failed is None:
+            return
+        done = [
+            outbox_id for outbox_id, action in zip(outbox_ids, actions)
+            if (action["_index"], str(action["_id"])) not in failed
+        ]
+        with app.app_context(), db.engine.begin() as connection:
+            bump_generations(connection, {action["_index"] for action in actions})
+            if done:
+                connection.execute(
+                    sa.delete(search_outbox).where(search_outbox.c.id.in_(done))
+                )
+
+    def submit_bulk(self, actions: list[dict], outbox_ids: list[int]) -> None:
+        """Send ``actions`` according to ``SEARCH_INDEXING_MODE``.
+
+        ``async`` hands them to the background indexer and only falls back to
+        indexing in the caller when its queue is full, ``sync`` indexes right
+        away and ``off`` drops them. Whatever is not acknowledged stays in the
+        outbox for ``flask es-search drain``.
+        """
+        if not actions or not self.indexing_enabled():
+            return
+        args = (current_app._get_current_object(), self.get_es_client(),
+                actions, outbox_ids)
+        if self.indexing_mode == "async":
+            queued = self.indexing_worker.submit(self.index_and_acknowledge, *args)
+            SEARCH_INDEX_QUEUE_DEPTH.set(self.indexing_worker.queue_depth)
+            if queued:
+                return
+            self.logger.warning(
+                "Search indexing queue is full (%s jobs), indexing synchronously.",
+                self.indexing_worker.queue_depth
+            )
+        self.index_and_acknowledge(*args)
+
+    def on_flush(self, session: so.Session, actions: list[dict]) -> None:
+        """Record ``actions`` in the outbox within the flushing transaction."""
+        if not self.indexing_enabled():
+            return
+        outbox_ids = session.connection().execute(
+            sa.insert(search_outbox).returning(
+                search_outbox.c.id, sort_by_parameter_order=True),
+            [
+                {"index_name": action["_index"], "doc_id": action["_id"],
+                 "op_type": action.get("_op_type", "index")}
+                for action in actions
+            ]
+        ).scalars().all()
+        changes = session.info.setdefault("search_changes", ([], []))
+        changes[0].extend(actions)
+        changes[1].extend(outbox_ids)
+
+    def on_commit(self, session: so.Session) -> None:
+        actions, outbox_ids = session.info.pop("search_changes", ([], []))
+        self.submit_bulk(actions, outbox_ids)
+
+    def on_rollback(self, session: so.Session) -> None:
+        session.info.pop("search_changes", None)
+
+    def reindex(self, model: type, workers: int = 4, partition_size: int = 50000) -> BulkReport:
+        """Rebuild the index into a new versioned index and swap the alias.
+
+        The table is split into primary-key ranges that are streamed to the
+        new index by ``workers`` threads while searches keep using the old
+        one. Rows added during the rebuild are sent after the swap, which
+        is skipped if any document could not be indexed.
+        """
+        alias = model.get_index_name()
+        new_index = self.versioned_index_name(alias)
+        self.get_es_client().indices.create(
+            index=new_index, body=self.index_body(model.suggest_fields))
+
+        min_id, max_id = db.session.execute(
+            sa.select(sa.func.min(model.id), sa.func.max(model.id))).one()
+        db.session.remove()
+        app = current_app._get_current_object()
+        report = BulkReport()
+        start = perf_counter()
+        if max_id is not None:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(self.reindex_range, app, model, new_index,
+                                    start, min(start + partition_size - 1, max_id))
+                    for start in range(min_id, max_id + 1, partition_size)
+                ]
+                for future in as_completed(futures):
+                    report.merge(future.result())
+        if report.failed:
+            raise RuntimeError(
+                f"Reindex into [{new_index}] failed, [{alias}] was left unchanged: {report}")
+
+        self.swap_alias(alias, new_index)
+        if max_id is not None:
+            report.merge(self.reindex_range(app, model, alias, max_id + 1))
+            model.save_checkpoint(db.session.scalar(sa.select(sa.func.max(model.id))))
+            db.session.commit()
+        report.seconds = perf_counter() - start
+        return report
+
+    def reindex_range(
+            self,
+            app: Flask,
+            model: type,
+            index: str,
+            start_id: int,
+            end_id: int | None = None
+    ) -> BulkReport:
+        """Stream the searchable columns of ids ``start_id``..``end_id`` to ``index``."""
+        with app.app_context():
+            query = sa.select(*model.search_columns()) \
+                .where(model.id >= start_id) \
+                .order_by(model.id) \
+                .execution_options(yield_per=1000)
+            if end_id is not None:
+                query = query.where(model.id <= end_id)
+            doc_stream = (
+                model.prepare_row_to_bulk(row, index)
+                for row in db.session.execute(query)
+            )
+            report = self.stream_documents_to_index(doc_stream, chunk_size=1000)
+            db.session.remove()
+        return report
+
+    @staticmethod
+    def match_query(query: str) -> dict:
+        return {"multi_match": {"query": query, "fields": ["*"]}}
+
+    def query_index(self, index, query, page, per_page) -> (list[int], int):
+        es_client = self.get_es_client()
+        if es_client is None:
+            return [], 0
+        with timed("search"), self.track("query"):
+            search = es_client.search(
+                index=index,
+                body={"query": self.match_query(query),
+                      "track_total_hits": self.track_total_hits},
+                from_=(page - 1) * per_page,
+                size=per_page)
+        ids = [int(hit['_id']) for hit in search['hits']['hits']]
+        return ids, search['hits']['total']['value']
+
+    def suggest(self, index: str, prefix: str, fields: list[str], limit: int) -> list[int]:
+        """Match ``prefix`` against the ``search_as_you_type`` subfields."""
+        es_client = self.get_es_client()
+        if es_client is None:
+            return []
+        with timed("search"), self.track("suggest"):
+            search = es_client.search(
+                index=index,
+                body={
+                    "query": {"multi_match": {
+                        "query": prefix,
+                        "type": "bool_prefix",
+                        "fields": [name for field in fields
+                                   for name in (field, f"{field}._2gram", f"{field}._3gram")]
+                    }},
+                    "_source": False,
+                    "track_total_hits": False,
+                    "size": limit
+                })
+        return [int(hit["_id"]) for hit in search["hits"]["hits"]]
+
+    def open_point_in_time(self, index: str) -> str | None:
+        """Open a point in time on ``index``, or return ``None`` if the cluster has none."""
+        if self.pit_supported is False:
+            return None
+        try:
+            with timed("search"), self.track("open_pit"):
+                pit_id = self.get_es_client().open_point_in_time(
+                    index=index, keep_alive=self.pit_keep_alive)["id"]
+        except ElasticsearchException:
+            self.logger.warning("Point in time is unavailable, using search_after on live index.")
+            self.pit_supported = False
+            return None
+        self.pit_supported = True
+        return pit_id
+
+    def query_index_cursor(
+            self,
+            index: str,
+            query: str,
+            per_page: int,
+            after: str | None = None,
+            before: str | None = None
+    ) -> (list[int], int, str | None, str | None):
+        """Page with ``search_after`` so deep pages cost the same as the first.
+
+        The first page is searched on the live index, and a point in time
+        is only opened when there is a next page; its id travels in the
+        cursors. The second page is read at offset ``per_page`` inside it,
+        and later ones with ``search_after``, sorted by score with
+        ``_shard_doc`` as the tiebreaker. Clusters without points in time
+        use ``_id`` instead. ``before`` cursors walk back by reversing the
+        sort. Expired or invalid cursors restart at the first page.
+        """
+        es_client = self.get_es_client()
+        if es_client is None:
+            return [], 0, None, None
+        cursor = decode_token(after) if after else decode_token(before)
+        backwards = not after and before is not None
+        if not isinstance(cursor, dict) or not (
+                isinstance(cursor.get("sort"), list)
+                or (isinstance(cursor.get("from"), int) and not backwards)):
+            cursor, backwards = None, False
+
+        pit_id = cursor.get("pit") if cursor else None
+        order, tiebreak_order = ("asc", "desc") if backwards else ("desc", "asc")
+        body = {
+            "query": self.match_query(query),
+            "size": per_page + 1,
+            "track_total_hits": self.track_total_hits,
+            "sort": [{"_score": order},
+                     {"_shard_doc" if pit_id else "_id": tiebreak_order}],
+        }
+        if cursor and "from" in cursor:
+            body["from"] = cursor["from"]
+        elif cursor:
+            body["search_after"] = cursor["sort"]
+        try:
+            with timed("search"), self.track("query"):
+                if pit_id:
+                    body["pit"] = {"id": pit_id, "keep_alive": self.pit_keep_alive}
+                    search = es_client.search(body=body)
+                else:
+                    search = es_client.search(index=index, body=body)
+        except NotFoundError:
+            if cursor is None:
+                raise
+            return self.query_index_cursor(index, query, per_page)
+
+        pit_id = search.get("pit_id", pit_id)
+        hits = search["hits"]["hits"]
+        has_more = len(hits) > per_page
+        hits = hits[:per_page]
+        if backwards:
+            hits.reverse()
+
+        def cursor_at(hit: dict) -> str:
+            return encode_token({"pit": pit_id, "sort": hit["sort"]})
+
+        if cursor is None:
+            next_cursor = None
+            if has_more:
+                pit_id = self.open_point_in_time(index)
+                next_cursor = encode_token({"pit": pit_id, "from": per_page}) if pit_id \
+                    else cursor_at(hits[-1])
+            prev_cursor = None
+        elif backwards:
+            next_cursor = cursor_at(hits[-1]) if hits else None
+            prev_cursor = cursor_at(hits[0]) if has_more else None
+        else:
+            next_cursor = cursor_at(hits[-1]) if has_more else None
+            prev_cursor = cursor_at(hits[0]) if hits else None
+        ids = [int(hit["_id"]) for hit in hits]
+        return ids, search["hits"]["total"]["value"], next_cursor, prev_cursor
+
+    def remove_all_docs_from_index(self, index: str) -> None:
+        es_client = self.get_es_client()
+        es_client.delete_by_query(
+            index=index,
+            body={
+                "query": {"match_all": {}}
+            }
+        )
+
+    def stream_documents_to_index(
+            self,
+            doc_stream: Iterable[dict],
+            chunk_size: int = 1000,
+            threads: int | None = None
+    ) -> BulkReport:
+        """Index ``doc_stream`` and report what happened to its documents.
+
+        With ``threads`` (default ``SEARCH_BULK_THREADS``) above one the
+        stream goes through ``helpers.parallel_bulk`` and rejected documents
+        are retried afterwards; otherwise it is sent in adaptive chunks.
+        """
+        threads = self.bulk_threads if threads is None else threads
+        report = BulkReport()
+        start = perf_counter()
+        if threads > 1:
+            self.parallel_bulk(doc_stream, chunk_size, threads, report)
+        else:
+            self.adaptive_bulk(doc_stream, chunk_size, report)
+        report.seconds = perf_counter() - start
+        log = self.logger.error if report.failed else self.logger.info
+        log("Bulk indexing finished: %s", report)
+        return report
+
+    def adaptive_bulk(self, doc_stream: Iterable[dict], chunk_size: int, report: BulkReport) -> None:
+        """Send chunks bounded by ``chunk_size`` documents and a byte budget.
+
+        The budget starts at ``SEARCH_BULK_MAX_CHUNK_BYTES``, is halved
+        whenever the cluster rejects documents and grows back by a tenth
+        after every clean chunk, so throughput follows cluster pressure.
+        """
+        chunk_bytes = self.bulk_max_chunk_bytes
+        chunk, size = [], 0
+        for action in doc_stream:
+            action_size = self.action_size(action)
+            if chunk and (len(chunk) >= chunk_size or size + action_size > chunk_bytes):
+                chunk_bytes = self.send_chunk(chunk, chunk_bytes, report)
+                chunk, size = [], 0
+            chunk.append(action)
+            size += action_size
+        if chunk:
+            self.send_chunk(chunk, chunk_bytes, report)
+
+    @staticmethod
+    def action_size(action: dict) -> int:
+        """Approximate size of ``action`` in a bulk request body."""
+        return len(json.dumps(action.get("_source", {}), default=str).encode("utf-8")) \
+            + BULK_METADATA_BYTES
+
+    def send_chunk(self, actions: list[dict], chunk_bytes: int, report: BulkReport) -> int:
+        """Send ``actions``, retrying rejections with backoff; return the new byte budget."""
+        for attempt in range(self.bulk_max_retries + 1):
+            rejected, failed = self.bulk_request(actions)
+            report.failed += failed
+            report.indexed += len(actions) - len(rejected) - failed
+            if not rejected:
+                return min(chunk_bytes + self.bulk_max_chunk_bytes // 10,
+                           self.bulk_max_chunk_bytes)
+            chunk_bytes = max(chunk_bytes // 2,
+                              min(BULK_MIN_CHUNK_BYTES, self.bulk_max_chunk_bytes))
+            if attempt == self.bulk_max_retries:
+                break
+            report.retried += len(rejected)
+            delay = min(BULK_INITIAL_BACKOFF * 2 ** attempt, BULK_MAX_BACKOFF)
+            self.logger.warning("Cluster rejected %s document(s), retrying in %.1fs",
+                                len(rejected), delay)
+            time.sleep(delay * random.uniform(0.5, 1.0))
+            actions = rejected
+        report.failed += len(rejected)
+        self.logger.error("Gave up on %s document(s) after %s retries",
+                          len(rejected), self.bulk_max_retries)
+        return chunk_bytes
+
+    def bulk_request(self, actions: list[dict]) -> (list[dict], int):
+        """Send ``actions`` as one request; return the rejected ones and the failure count."""
+        try:
+            with timed("search"), self.track("bulk"):
+                _, errors = helpers.bulk(
+                    self.get_es_client(), actions, chunk_size=len(actions),
+                    max_chunk_bytes=2 ** 31, raise_on_error=False)
+        except TransportError as e:
+            if isinstance(e, ConnectionError) or e.status_code in REJECTED_STATUSES:
+                return actions, 0
+            self.logger.error("Bulk request with %s actions failed: %s", len(actions), e)
+            return [], len(actions)
+
+        by_id = {}
+        for action in actions:
+            by_id.setdefault(str(action["_id"]), []).append(action)
+        rejected, failed = [], 0
+        for error in errors:
+            op_type, response = next(iter(error.items()))
+            if op_type == "delete" and response.get("status") == 404:
+                continue
+            if response.get("status") in REJECTED_STATUSES:
+                rejected.append(by_id[str(response.get("_id"))].pop(0))
+                continue
+            failed += 1
+            self.logger.error(
+                "Failed to %s doc %s | status=%s | error=%s",
+                op_type, response.get("_id"), response.get("status"), response.get("error")
+            )
+        return rejected, failed
+
+    def parallel_bulk(
+            self,
+            doc_stream: Iterable[dict],
+            chunk_size: int,
+            threads: int,
+            report: BulkReport
+    ) -> None:
+        """Index through ``helpers.parallel_bulk`` and retry the rejections adaptively."""
+        # parallel_bulk answers in stream order, so the action of each result
+        # is the oldest one still in flight.
+        in_flight = deque()
+
+        def tracked_stream():
+            for action in doc_stream:
+                in_flight.append(action)
+                yield action
+
+        rejected = []
+        with timed("search"), self.track("parallel_bulk"):
+            for ok, item in helpers.parallel_bulk(
+                    self.get_es_client(), tracked_stream(), thread_count=threads,
+                    chunk_size=chunk_size, max_chunk_bytes=self.bulk_max_chunk_bytes,
+                    raise_on_error=False, raise_on_exception=False):
+                action = in_flight.popleft()
+                if ok:
+                    report.indexed += 1
+                    continue
+                op_type, response = next(iter(item.items()))
+                if response.get("status") in REJECTED_STATUSES \
+                        or isinstance(response.get("exception"), ConnectionError):
+                    rejected.append(action)
+                    continue
+                report.failed += 1
+                self.logger.error(
+                    "Failed to %s doc %s | status=%s | error=%s",
+                    op_type, response.get("_id"), response.get("status"), response.get("error")
+                )
+        if rejected:
+            report.retried += len(rejected)
+            self.adaptive_bulk(rejected, chunk_size, report)
+
+
+es_service = ElasticsearchService()
+
@@ -0,0 +1,650 @@
+import fcntl
+import heapq
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import secrets
+import shutil
+import struct
+import tempfile
+import unicodedata
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from itertools import groupby
+from typing import Iterable, Iterator
+
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from flask import Flask, current_app
+
+from app.background import BackgroundWorker
+from app.db import db
+from app.instrumentation import timed
+from app.search.backend import SearchBackend, bump_generations
+
+TOKEN_PATTERN = re.compile(r"\w+")
+STOPWORDS = {
+    "en": frozenset(
+        "a an and are as at be but by for from has have i in is it its of on "
+        "or that the this to was were will with".split()
+    ),
+    "uk": frozenset(
+        "а але би в від до з за і й із на не ні по та те то у це що як".split()
+    ),
+}
+
+
+def stem_en(token: str) -> str:
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith(("ss", "us", "is")):
+        return token[:-1]
+    return token
+
+
+STEMMERS = {"en": stem_en}
+
+
+def tokenize(text: str, language: str | None = None) -> list[str]:
+    """Split ``text`` into normalized terms using the rules of ``language``."""
+    language = (language or "").split("-")[0].lower()
+    stopwords = STOPWORDS.get(language, frozenset())
+    stem = STEMMERS.get(language)
+    tokens = []
+    for token in TOKEN_PATTERN.findall(unicodedata.normalize("NFKC", text).casefold()):
+        if token in stopwords:
+            continue
+        tokens.append(stem(token) if stem else token)
+    return tokens
+
+
+def query_terms(text: str) -> set[str]:
+    """Terms of a query, analyzed the way each supported language would index them."""
+    terms = set(tokenize(text))
+    for language in STOPWORDS:
+        terms.update(tokenize(text, language))
+    return terms
+
+
+class Segment:
+    """An immutable, memory-mapped part of an index.
+
+    The file holds a header followed by uint32 arrays: sorted document ids,
+    their lengths, term and postings offsets, the postings themselves as
+    document positions and term frequencies, and finally the sorted
+    UTF-8 terms. Nothing is copied into the process, so every worker that
+    maps the file shares the same pages.
+    """
+
+    HEADER = struct.Struct("<4sIIII")
+    MAGIC = b"BM25"
+
+    def __init__(self, path: str) -> None:
+        self.name = os.path.basename(path)
+        with open(path, "rb") as segment_file:
+            self._mmap = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, num_docs, num_terms, num_postings, terms_size = self.HEADER.unpack_from(self._mmap)
+        if magic != self.MAGIC:
+            raise ValueError(f"{path} is not an index segment")
+
+        view = memoryview(self._mmap)
+        offset = self.HEADER.size
+
+        def take(count: int) -> memoryview:
+            nonlocal offset
+            part = view[offset:offset + 4 * count].cast("I")
+            offset += 4 * count
+            return part
+
+        self.doc_ids = take(num_docs)
+        self.doc_lengths = take(num_docs)
+        self.term_offsets = take(num_terms + 1)
+        self.posting_offsets = take(num_terms + 1)
+        self.posting_docs = take(num_postings)
+        self.posting_freqs = take(num_postings)
+        self.terms = view[offset:offset + terms_size]
+        self.num_terms = num_terms
+
+    def term(self, position: int) -> bytes:
+        return bytes(self.terms[self.term_offsets[position]:self.term_offsets[position + 1]])
+
+    def lower_bound(self, key: bytes) -> int:
+        low, high = 0, self.num_terms
+        while low < high:
+            middle = (low + high) // 2
+            if self.term(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def postings(self, term: str) -> tuple[memoryview, memoryview] | None:
+        key = term.encode()
+        low = self.lower_bound(key)
+        if low == self.num_terms or self.term(low) != key:
+            return None
+        start, end = self.posting_offsets[low], self.posting_offsets[low + 1]
+        return self.posting_docs[start:end], self.posting_freqs[start:end]
+
+    def terms_with_prefix(self, prefix: str, limit: int) -> list[str]:
+        """Return up to ``limit`` terms starting with ``prefix``, in order."""
+        key = prefix.encode()
+        terms = []
+        position = self.lower_bound(key)
+        while position < self.num_terms and len(terms) < limit:
+            term = self.term(position)
+            if not term.startswith(key):
+                break
+            terms.append(term.decode())
+            position += 1
+        return terms
+
+    def position(self, doc_id: int) -> int | None:
+        position = bisect_left(self.doc_ids, doc_id)
+        if position < len(self.doc_ids) and self.doc_ids[position] == doc_id:
+            return position
+        return None
+
+    def live_documents(self, tag: int, dead: frozenset) -> Iterator[tuple[int, int, int]]:
+        """Yield ``(doc_id, tag, position)`` for the documents not in ``dead``, in order."""
+        for position, doc_id in enumerate(self.doc_ids):
+            if doc_id not in dead:
+                yield doc_id, tag, position
+
+    def all_terms(self, tag: int) -> Iterator[tuple[bytes, int, int]]:
+        """Yield ``(term, tag, position)`` for every term, in order."""
+        for position in range(self.num_terms):
+            yield self.term(position), tag, position
+
+    @classmethod
+    def write(cls, path: str, documents: dict[int, Counter]) -> None:
+        doc_ids = sorted(documents)
+        doc_lengths = array("I")
+        postings = defaultdict(list)
+        for position, doc_id in enumerate(doc_ids):
+            terms = documents[doc_id]
+            doc_lengths.append(sum(terms.values()))
+            for term, freq in terms.items():
+                postings[term.encode()].append((position, freq))
+
+        terms = sorted(postings)
+        term_offsets, posting_offsets = array("I", [0]), array("I", [0])
+        posting_docs, posting_freqs = array("I"), array("I")
+        terms_blob = bytearray()
+        for term in terms:
+            terms_blob += term
+            term_offsets.append(len(terms_blob))
+            for position, freq in postings[term]:
+                posting_docs.append(position)
+                posting_freqs.append(freq)
+            posting_offsets.append(len(posting_docs))
+
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "wb") as segment_file:
+            segment_file.write(cls.HEADER.pack(
+                cls.MAGIC, len(doc_ids), len(terms), len(posting_docs), len(terms_blob)))
+            for part in (array("I", doc_ids), doc_lengths, term_offsets,
+                         posting_offsets, posting_docs, posting_freqs):
+                part.tofile(segment_file)
+            segment_file.write(terms_blob)
+            segment_file.flush()
+            os.fsync(segment_file.fileno())
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def merge(cls, path: str, sources: list[tuple["Segment", frozenset]]) -> int:
+        """Write the live documents of ``sources`` to ``path``; return their number.
+
+        Documents and terms are merged in sorted order straight from the
+        mapped sources, and the postings are spooled through temporary
+        files, so only the offsets and one term's postings are held in
+        memory.
+        """
+        remaps = [array("i", [-1]) * len(segment.doc_ids) for segment, _ in sources]
+        live_docs = heapq.merge(*[
+            segment.live_documents(source, dead)
+            for source, (segment, dead) in enumerate(sources)
+        ])
+        doc_ids, doc_lengths = SpoolArray(), SpoolArray()
+        for doc_id, source, position in live_docs:
+            remaps[source][position] = len(doc_ids)
+            doc_ids.append(doc_id)
+            doc_lengths.append(sources[source][0].doc_lengths[position])
+        if not len(doc_ids):
+            return 0
+
+        all_terms = heapq.merge(*[
+            segment.all_terms(source) for source, (segment, _) in enumerate(sources)
+        ])
+        term_offsets, posting_offsets = array("I", [0]), array("I", [0])
+        posting_docs, posting_freqs = SpoolArray(), SpoolArray()
+        terms_blob = SpoolBytes()
+        for term, matches in groupby(all_terms, key=lambda match: match[0]):
+            postings = []
+            for _, source, term_position in matches:
+                segment, remap = sources[source][0], remaps[source]
+                start = segment.posting_offsets[term_position]
+                end = segment.posting_offsets[term_position + 1]
+                for position, freq in zip(segment.posting_docs[start:end],
+                                          segment.posting_freqs[start:end]):
+                    if remap[position] >= 0:
+                        postings.append((remap[position], freq))
+            if not postings:
+                continue
+            postings.sort()
+            for position, freq in postings:
+                posting_docs.append(position)
+                posting_freqs.append(freq)
+            terms_blob.write(term)
+            term_offsets.append(len(terms_blob))
+            posting_offsets.append(len(posting_docs))
+
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "wb") as segment_file:
+            segment_file.write(cls.HEADER.pack(
+                cls.MAGIC, len(doc_ids), len(term_offsets) - 1, len(posting_docs),
+                len(terms_blob)))
+            doc_ids.copy_to(segment_file)
+            doc_lengths.copy_to(segment_file)
+            term_offsets.tofile(segment_file)
+            posting_offsets.tofile(segment_file)
+            posting_docs.copy_to(segment_file)
+            posting_freqs.copy_to(segment_file)
+            terms_blob.copy_to(segment_file)
+            segment_file.flush()
+            os.fsync(segment_file.fileno())
+        os.replace(temporary_path, path)
+        return len(doc_ids)
+
+
+class SpoolBytes:
+    """An append-only byte buffer kept in a temporary file."""
+
+    def __init__(self) -> None:
+        self._file = tempfile.TemporaryFile()
+        self._size = 0
+
+    def write(self, data: bytes) -> None:
+        self._file.write(data)
+        self._size += len(data)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def copy_to(self, target) -> None:
+        self._file.seek(0)
+        shutil.copyfileobj(self._file, target)
+        self._file.close()
+
+
+class SpoolArray(SpoolBytes):
+    """An append-only uint32 array kept in a temporary file."""
+
+    BUFFER_SIZE = 65536
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._buffer = array("I")
+
+    def append(self, value: int) -> None:
+        self._buffer.append(value)
+        if len(self._buffer) == self.BUFFER_SIZE:
+            self.write(self._buffer.tobytes())
+            del self._buffer[:]
+
+    def __len__(self) -> int:
+        return (self._size + 4 * len(self._buffer)) // 4
+
+    def copy_to(self, target) -> None:
+        self.write(self._buffer.tobytes())
+        del self._buffer[:]
+        super().copy_to(target)
+
+
+class InvertedIndex:
+    """The segments of one index, listed in ``manifest.json``.
+
+    Each change set becomes a new segment and tombstones the older copies
+    of its documents. Writers serialize on a file lock, so every gunicorn
+    worker can apply its own commits; readers reopen the manifest when it
+    is replaced.
+
+    Segments are grouped into tiers by their number of live documents,
+    each tier ``MERGE_FACTOR`` times larger than the one below. ``merge``
+    combines ``MERGE_FACTOR`` segments of the smallest full tier, so every
+    document is rewritten once per tier and the segment count grows with
+    the logarithm of the index size.
+    """
+
+    MERGE_FACTOR = 10
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, "manifest.json")
+        self.segments = []
+        self.generation = 0
+        self.doc_count = 0
+        self.total_length = 0
+        self._stamp = None
+
+    @contextmanager
+    def locked(self, operation: int = fcntl.LOCK_EX):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, "lock"), "a") as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def refresh(self) -> None:
+        try:
+            stat = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            self.segments, self.doc_count, self.total_length = [], 0, 0
+            self._stamp = None
+            return
+        if (stat.st_ino, stat.st_mtime_ns) == self._stamp:
+            return
+        with self.locked(fcntl.LOCK_SH):
+            self.load()
+
+    def load(self) -> None:
+        try:
+            stat = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return
+        with open(self.manifest_path, encoding="utf-8") as manifest_file:
+            manifest = json.load(manifest_file)
+        opened = {segment.name: segment for segment, _ in self.segments}
+        self.segments = [
+            (opened.get(name) or Segment(os.path.join(self.directory, name)),
+             frozenset(manifest["deleted"].get(name, ())))
+            for name in manifest["segments"]
+        ]
+        self.generation = manifest["generation"]
+        self.doc_count = manifest["doc_count"]
+        self.total_length = manifest["total_length"]
+        self._stamp = (stat.st_ino, stat.st_mtime_ns)
+
+    def save(self, segments: list[str], deleted: dict[str, set[int]],
+             doc_count: int, total_length: int) -> None:
+        temporary_path = self.manifest_path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as manifest_file:
+            json.dump({
+                "generation": self.generation + 1,
+                "segments": segments,
+                "deleted": {name: sorted(deleted[name]) for name in segments if deleted.get(name)},
+                "doc_count": doc_count,
+                "total_length": total_length,
+            }, manifest_file)
+        dropped = [segment.name for segment, _ in self.segments if segment.name not in segments]
+        os.replace(temporary_path, self.manifest_path)
+        self.load()
+        for name in dropped:
+            os.remove(os.path.join(self.directory, name))
+
+    def new_segment(self, documents: dict[int, Counter]) -> str:
+        name = f"{self.generation + 1:010d}.seg"
+        Segment.write(os.path.join(self.directory, name), documents)
+        return name
+
+    def apply(self, changes: dict[int, Counter | None]) -> None:
+        """Index the ``Counter`` of each document id and delete those mapped to ``None``."""
+        with self.locked():
+            self.load()
+            deleted = {segment.name: set(dead) for segment, dead in self.segments}
+            doc_count, total_length = self.doc_count, self.total_length
+            for segment, dead in self.segments:
+                for doc_id in changes:
+                    position = segment.position(doc_id)
+                    if position is None or doc_id in dead:
+                        continue
+                    deleted[segment.name].add(doc_id)
+                    doc_count -= 1
+                    total_length -= segment.doc_lengths[position]
+
+            segments = [segment.name for segment, _ in self.segments]
+            documents = {doc_id: terms for doc_id, terms in changes.items() if terms is not None}
+            doc_count += len(documents)
+            total_length += sum(sum(terms.values()) for terms in documents.values())
+            if documents:
+                segments.append(self.new_segment(documents))
+            self.save(segments, deleted, doc_count, total_length)
+
+    def pick_merge(self) -> list[str]:
+        """Name the ``MERGE_FACTOR`` smallest segments of the smallest full tier."""
+        tiers = defaultdict(list)
+        for segment, dead in self.segments:
+            live = len(segment.doc_ids) - len(dead)
+            tiers[int(math.log(max(live, 1), self.MERGE_FACTOR))].append((live, segment.name))
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= self.MERGE_FACTOR:
+                return [name for _, name in sorted(tiers[tier])[:self.MERGE_FACTOR]]
+        return []
+
+    def merge(self) -> bool:
+        """Merge one tier of segments if the policy picks one; return whether it did.
+
+        The merged segment is written without holding the lock. Documents
+        deleted meanwhile are tombstoned in it when it is swapped in, and
+        the merge is abandoned if another worker merged the same segments.
+        """
+        with self.locked():
+            self.load()
+            picked = self.pick_merge()
+            sources = [(segment, dead) for segment, dead in self.segments
+                       if segment.name in picked]
+        if not sources:
+            return False
+
+        name = f"{self.generation + 1:010d}-{secrets.token_hex(4)}.seg"
+        path = os.path.join(self.directory, name)
+        merged = Segment.merge(path, sources)
+
+        with self.locked():
+            self.load()
+            current = {segment.name: dead for segment, dead in self.segments}
+            if any(segment.name not in current for segment, _ in sources):
+                if merged:
+                    os.remove(path)
+                return False
+            deleted = {segment.name: set(dead) for segment, dead in self.segments
+                       if segment.name not in picked}
+            segments = [segment.name for segment, _ in self.segments
+                        if segment.name not in picked]
+            if merged:
+                merged_segment = Segment(path)
+                deleted[name] = {
+                    doc_id
+                    for segment, dead in sources
+                    for doc_id in current[segment.name] - dead
+                    if merged_segment.position(doc_id) is not None
+                }
+                segments.insert(0, name)
+            self.save(segments, deleted, self.doc_count, self.total_length)
+        return True
+
+    def rebuild(self, documents: dict[int, Counter]) -> None:
+        with self.locked():
+            self.load()
+            segments = [self.new_segment(documents)] if documents else []
+            self.save(segments, {}, len(documents),
+                      sum(sum(terms.values()) for terms in documents.values()))
+
+    def expand_prefix(self, prefix: str, limit: int = 50) -> set[str]:
+        """Return up to ``limit`` indexed terms starting with ``prefix``."""
+        self.refresh()
+        terms = set()
+        for segment, _ in self.segments:
+            terms.update(segment.terms_with_prefix(prefix, limit))
+        return set(sorted(terms)[:limit])
+
+    def search(self, terms: Iterable[str], k1: float = 1.2, b: float = 0.75) -> dict[int, float]:
+        """Return the BM25 score of every live document matching any of ``terms``."""
+        self.refresh()
+        scores = defaultdict(float)
+        if not self.doc_count:
+            return scores
+        average_length = self.total_length / self.doc_count
+        for term in terms:
+            matches = [
+                (segment, dead, postings)
+                for segment, dead in self.segments
+                if (postings := segment.postings(term)) is not None
+            ]
+            doc_freq = sum(len(postings[0]) for _, _, postings in matches)
+            if not doc_freq:
+                continue
+            idf = math.log(1 + (self.doc_count - doc_freq + 0.5) / (doc_freq + 0.5))
+            for segment, dead, (positions, freqs) in matches:
+                for position, freq in zip(positions, freqs):
+                    doc_id = segment.doc_ids[position]
+                    if doc_id in dead:
+                        continue
+                    norm = k1 * (1 - b + b * segment.doc_lengths[position] / average_length)
+                    scores[doc_id] += idf * freq * (k1 + 1) / (freq + norm)
+        return scores
+
+
+class InvertedIndexService(SearchBackend):
+    """In-process full-text search ranked with BM25.
+
+    Every index lives under ``SEARCH_INDEX_DIR`` as memory-mapped segments
+    (see ``InvertedIndex``) that are updated from the commit hooks, so a
+    single-node deployment needs neither Elasticsearch nor database
+    full-text support. Like the Elasticsearch backend, committed changes
+    and the segment merges they trigger run on a background worker
+    according to ``SEARCH_INDEXING_MODE``.
+    """
+
+    def __init__(self) -> None:
+        self.directory = None
+        self.indexes = {}
+        self.indexing_mode = "async"
+        self.indexing_worker = BackgroundWorker("inverted-indexer")
+        self.logger = logging.getLogger("app.search")
+
+    def init_app(self, app: Flask) -> None:
+        directory = app.config["SEARCH_INDEX_DIR"]
+        if directory != self.directory:
+            self.directory = directory
+            self.indexes = {}
+        self.indexing_mode = app.config["SEARCH_INDEXING_MODE"]
+        # A single thread keeps each process's commits in order.
+        self.indexing_worker.configure(
+            max_queue=app.config["SEARCH_INDEXING_QUEUE_SIZE"], num_threads=1)
+
+    def indexing_enabled(self) -> bool:
+        return self.indexing_mode != "off"
+
+    def get_index(self, index_name: str) -> InvertedIndex:
+        index = self.indexes.get(index_name)
+        if index is None:
+            index = self.indexes.setdefault(
+                index_name, InvertedIndex(os.path.join(self.directory, index_name)))
+        return index
+
+    @staticmethod
+    def analyze(action: dict) -> Counter:
+        text = " ".join(str(value) for value in action["_source"].values() if value is not None)
+        return Counter(tokenize(text, action.get("_language")))
+
+    def create_index(
+            self,
+            index_name: str,
+            fields: list[str],
+            suggest_fields: list[str] = ()
+    ) -> None:
+        os.makedirs(self.get_index(index_name).directory, exist_ok=True)
+
+    def query_index(self, index: str, query: str, page: int, per_page: int) -> (list[int], int):
+        with timed("search"), self.track("query"):
+            scores = self.get_index(index).search(query_terms(query))
+            ranked = heapq.nsmallest(page * per_page, scores,
+                                     key=lambda doc_id: (-scores[doc_id], doc_id))
+        return ranked[(page - 1) * per_page:], len(scores)
+
+    def suggest(self, index: str, prefix: str, fields: list[str], limit: int) -> list[int]:
+        """Expand the last word over the sorted segment terms and rank with BM25.
+
+        Every result contains a completion of the last word; the earlier
+        words only add to the score.
+        """
+        words = TOKEN_PATTERN.findall(unicodedata.normalize("NFKC", prefix).casefold())
+        if not words:
+            return []
+        inverted_index = self.get_index(index)
+        with timed("search"), self.track("suggest"):
+            scores = inverted_index.search(inverted_index.expand_prefix(words[-1]))
+            if len(words) > 1:
+                for doc_id, score in inverted_index.search(
+                        query_terms(" ".join(words[:-1]))).items():
+                    if doc_id in scores:
+                        scores[doc_id] += score
+            return heapq.nsmallest(limit, scores, key=lambda doc_id: (-scores[doc_id], doc_id))
+
+    def bulk(self, actions: list[dict]) -> set[tuple[str, str]] | None:
+        changes = defaultdict(dict)
+        for action in actions:
+            terms = None
+            if action.get("_op_type", "index") == "index":
+                terms = self.analyze(action)
+            changes[action["_index"]][int(action["_id"])] = terms
+        with timed("search"), self.track("bulk"):
+            for index_name, index_changes in changes.items():
+                self.get_index(index_name).apply(index_changes)
+        return set()
+
+    def on_flush(self, session: so.Session, actions: list[dict]) -> None:
+        session.info.setdefault("search_changes", []).extend(actions)
+
+    def index_and_merge(self, app: Flask, actions: list[dict]) -> None:
+        """Apply ``actions``, then merge the segments the policy picks.
+
+        The index generations are bumped again once the changes are
+        visible, dropping results cached while they were queued.
+        """
+        self.bulk(actions)
+        index_names = {action["_index"] for action in actions}
+        with app.app_context(), db.engine.begin() as connection:
+            bump_generations(connection, index_names)
+        for index_name in index_names:
+            index = self.get_index(index_name)
+            with self.track("merge"):
+                while index.merge():
+                    pass
+
+    def on_commit(self, session: so.Session) -> None:
+        actions = session.info.pop("search_changes", [])
+        if not actions or not self.indexing_enabled():
+            return
+        app = current_app._get_current_object()
+        if self.indexing_mode == "async":
+            if self.indexing_worker.submit(self.index_and_merge, app, actions):
+                return
+            self.logger.warning(
+                "Search indexing queue is full (%s jobs), indexing synchronously.",
+                self.indexing_worker.queue_depth
+            )
+        self.index_and_merge(app, actions)
+
+    def on_rollback(self, session: so.Session) -> None:
+        session.info.pop("search_changes", None)
+
+    def reindex(self, model: type, workers: int = 4, partition_size: int = 50000) -> None:
+        """Rebuild the index from the model's rows into a single segment."""
+        query = sa.select(*model.search_columns()).execution_options(yield_per=1000)
+        documents = {
+            row.id: self.analyze(model.prepare_row_to_bulk(row))
+            for row in db.session.execute(query)
+        }
+        self.get_index(model.get_index_name()).rebuild(documents)
+
+
+inverted_index_service = InvertedIndexService()
@@ -0,0 +1,333 @@
+import re
+import time
+
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from flask import current_app
+
+from app.cache import search_cache
+from app.db import db
+from app.pagination import KeysetPagination
+from app.search.backend import (
+    SearchBackend,
+    bump_generations,
+    load_generation,
+    search_checkpoint,
+    search_outbox
+)
+from app.search.database import db_search_service
+from app.search.elasticsearch import es_service
+from app.search.inverted import inverted_index_service
+
+search_backends = {
+    "elasticsearch": es_service,
+    "database": db_search_service,
+    "inverted": inverted_index_service,
+}
+
+
+def get_search_backend() -> SearchBackend:
+    """Return the backend named by ``SEARCH_BACKEND``.
+
+    Without a setting, Elasticsearch is used when ``ELASTICSEARCH_URL`` is
+    configured and the database's own full-text search otherwise.
+    """
+    name = current_app.config.get("SEARCH_BACKEND")
+    if not name:
+        name = "elasticsearch" if current_app.elasticsearch is not None else "database"
+    return search_backends[name]
+
+
+def normalize_query(expression: str) -> str:
+    return re.sub(r"\s+", " ", expression).strip().casefold()
+
+
+class SearchableMixin:
+    searchable_fields = []
+    search_eager_load = []
+    search_language_field = None
+    suggest_fields = []
+    index_name = None
+
+    @classmethod
+    def get_index_name(cls) -> str:
+        if cls.index_name is None:
+            cls.index_name = cls.__tablename__
+        return cls.index_name
+
+    def get_searchable_fields(self) -> list:
+        if not self.searchable_fields:
+            raise AttributeError('Specify the searchable_fields attribute')
+        return self.searchable_fields
+
+    def prepare_document(self) -> dict:
+        return {
+            "document": {
+                field: getattr(self, field)
+                for field in self.get_searchable_fields()
+            }
+        }
+
+    def prepare_data_to_bulk(self) -> dict:
+        action = {
+            "_index": self.get_index_name(),
+            "_id": self.id,
+            "_source": self.prepare_document()["document"]
+        }
+        if self.search_language_field is not None:
+            action["_language"] = getattr(self, self.search_language_field)
+        return action
+
+    @classmethod
+    def search_columns(cls: db.Model) -> list:
+        """The columns ``prepare_row_to_bulk`` needs, for bulk queries."""
+        columns = [cls.id, *[getattr(cls, field) for field in cls.searchable_fields]]
+        if cls.search_language_field is not None:
+            columns.append(getattr(cls, cls.search_language_field))
+        return columns
+
+    @classmethod
+    def prepare_row_to_bulk(cls: db.Model, row: sa.Row, index: str | None = None) -> dict:
+        action = {
+            "_index": index or cls.get_index_name(),
+            "_id": row.id,
+            "_source": {field: getattr(row, field) for field in cls.searchable_fields}
+        }
+        if cls.search_language_field is not None:
+            action["_language"] = getattr(row, cls.search_language_field)
+        return action
+
+    def prepare_delete_to_bulk(self) -> dict:
+        return {
+            "_op_type": "delete",
+            "_index": self.get_index_name(),
+            "_id": self.id
+        }
+
+    def add_instance_to_index(self) -> None:
+        get_search_backend().bulk([self.prepare_data_to_bulk()])
+
+    def remove_instance_from_index(self, index: str = None) -> None:
+        action = self.prepare_delete_to_bulk()
+        if index is not None:
+            action["_index"] = index
+        get_search_backend().bulk([action])
+
+    @classmethod
+    def search(cls: db.Model, expression: str, page: int, per_page: int) -> (list, int):
+        """Return a page of matching instances and the total number of matches.
+
+        The ids and total are cached per index generation, which every
+        transaction that changes the index bumps in the database, so no
+        worker serves results from before the change.
+        """
+        index = cls.get_index_name()
+        key = (index, load_generation(index), normalize_query(expression),
+               page, per_page)
+        result = search_cache.get(key)
+        if result is None:
+            ids, total = get_search_backend().query_index(index, expression, page, per_page)
+            result = (tuple(ids), total)
+            search_cache.set(key, result)
+        ids, total = result
+        if total == 0:
+            return [], 0
+        return cls.load_search_results(ids), total
+
+    @classmethod
+    def search_page(
+            cls: db.Model,
+            expression: str,
+            per_page: int,
+            after: str | None = None,
+            before: str | None = None
+    ) -> (KeysetPagination, int):
+        """Like ``search``, but addressed by the backend's opaque cursors."""
+        index = cls.get_index_name()
+        key = (index, load_generation(index), normalize_query(expression),
+               after, before, per_page)
+        result = search_cache.get(key)
+        if result is None:
+            ids, total, next_cursor, prev_cursor = get_search_backend().query_index_cursor(
+                index, expression, per_page, after=after, before=before)
+            result = (tuple(ids), total, next_cursor, prev_cursor)
+            search_cache.set(key, result)
+        ids, total, next_cursor, prev_cursor = result
+        items = cls.load_search_results(ids).all() if ids else []
+        return KeysetPagination(items, next_cursor, prev_cursor), total
+
+    @classmethod
+    def suggest(cls: db.Model, prefix: str, limit: int) -> list:
+        """Return up to ``limit`` instances completing ``prefix``, for typeahead."""
+        ids = get_search_backend().suggest(
+            cls.get_index_name(), prefix, cls.suggest_fields or cls.searchable_fields, limit)
+        return cls.load_search_results(ids).all() if ids else []
+
+    @classmethod
+    def load_search_results(cls: db.Model, ids: tuple[int, ...]) -> sa.ScalarResult:
+        """Load the instances of ``ids`` in that order, with ``search_eager_load``."""
+        when = []
+        for i in range(len(ids)):
+            when.append((ids[i], i))
+        query = sa.select(cls).where(cls.id.in_(ids)).order_by(
+            db.case(*when, value=cls.id))
+        for relationship in cls.search_eager_load:
+            attribute = getattr(cls, relationship)
+            loader = so.selectinload if attribute.property.uselist else so.joinedload
+            query = query.options(loader(attribute))
+        return db.session.scalars(query)
+
+    @classmethod
+    def after_flush(cls: db.Model, session: db.session, flush_context) -> None:
+        actions = [
+            obj.prepare_data_to_bulk()
+            for obj in (*session.new, *session.dirty)
+            if isinstance(obj, SearchableMixin)
+        ]
+        actions += [
+            obj.prepare_delete_to_bulk()
+            for obj in session.deleted
+            if isinstance(obj, SearchableMixin)
+        ]
+        if actions:
+            bump_generations(session.connection(),
+                             {action["_index"] for action in actions})
+            get_search_backend().on_flush(session, actions)
+
+    @classmethod
+    def after_commit(cls: db.Model, session: db.session) -> None:
+        if "search_changes" in session.info:
+            get_search_backend().on_commit(session)
+
+    @classmethod
+    def after_rollback(cls: db.Model, session: db.session) -> None:
+        session.info.pop("search_changes", None)
+
+    @classmethod
+    def reindex(cls: db.Model, workers: int = 4, partition_size: int = 50000):
+        """Rebuild the index; returns the backend's report, if it makes one."""
+        return get_search_backend().reindex(cls, workers, partition_size)
+
+    @classmethod
+    def load_checkpoint(cls: db.Model) -> int:
+        return db.session.scalar(
+            sa.select(search_checkpoint.c.last_id)
+            .where(search_checkpoint.c.index_name == cls.get_index_name())
+        ) or 0
+
+    @classmethod
+    def save_checkpoint(cls: db.Model, last_id: int) -> None:
+        result = db.session.execute(
+            sa.update(search_checkpoint)
+            .where(search_checkpoint.c.index_name == cls.get_index_name())
+            .values(last_id=last_id)
+        )
+        if result.rowcount == 0:
+            db.session.execute(
+                sa.insert(search_checkpoint)
+                .values(index_name=cls.get_index_name(), last_id=last_id)
+            )
+
+    @classmethod
+    def reindex_incremental(cls: db.Model, chunk_size: int = 1000) -> int:
+        """Send the rows added since the stored checkpoint and return their count.
+
+        The id high-water mark is committed after every chunk, so an
+        interrupted run resumes where it stopped. Edits and deletions are
+        covered by the search outbox.
+        """
+        last_id = cls.load_checkpoint()
+        sent = 0
+        while True:
+            rows = db.session.execute(
+                sa.select(*cls.search_columns())
+                .where(cls.id > last_id)
+                .order_by(cls.id)
+                .limit(chunk_size)
+            ).all()
+            if not rows:
+                return sent
+            failed = get_search_backend().bulk([cls.prepare_row_to_bulk(row) for row in rows])
+            if failed is None or failed:
+                raise RuntimeError(
+                    f"Incremental reindex of [{cls.get_index_name()}] failed "
+                    f"after id {last_id}"
+                )
+            last_id = rows[-1].id
+            cls.save_checkpoint(last_id)
+            db.session.commit()
+            sent += len(rows)
+
+    @classmethod
+    def create_index(cls) -> None:
+        get_search_backend().create_index(
+            cls.get_index_name(), cls.searchable_fields, cls.suggest_fields)
+
+
+def searchable_models() -> list[type]:
+    return [
+        mapper.class_
+        for mapper in db.Model.registry.mappers
+        if issubclass(mapper.class_, SearchableMixin)
+    ]
+
+
+@sa.event.listens_for(db.metadata, "after_create")
+def create_database_search_tables(target, connection, **kw) -> None:
+    """Create the full-text tables along with ``db.create_all()``."""
+    for model in searchable_models():
+        db_search_service.create_index(
+            model.get_index_name(), model.searchable_fields, connection=connection)
+
+
+def drain_search_outbox(batch_size: int = 5000, max_retries: int = 5) -> int:
+    """Re-send the index changes left in the outbox and return how many were sent.
+
+    Rows are read in id order and collapsed per document, so only the last
+    intent for each document is sent, built from the row's current state.
+    """
+    models = {model.get_index_name(): model for model in searchable_models()}
+    backend = get_search_backend()
+    drained = 0
+    while True:
+        rows = db.session.execute(
+            sa.select(search_outbox).order_by(search_outbox.c.id).limit(batch_size)
+        ).all()
+        if not rows:
+            return drained
+
+        latest = {(row.index_name, row.doc_id): row.op_type for row in rows}
+        actions = []
+        for index_name, model in models.items():
+            ids = [doc_id for (index, doc_id), op_type in latest.items()
+                   if index == index_name and op_type == "index"]
+            found = {
+                obj.id: obj
+                for obj in db.session.scalars(sa.select(model).where(model.id.in_(ids)))
+            } if ids else {}
+            for (index, doc_id), op_type in latest.items():
+                if index != index_name:
+                    continue
+                obj = found.get(doc_id)
+                if obj is not None:
+                    actions.append(obj.prepare_data_to_bulk())
+                else:
+                    actions.append({"_op_type": "delete", "_index": index, "_id": doc_id})
+
+        for attempt in range(max_retries + 1):
+            failed = backend.bulk(actions)
+            if failed is not None:
+                break
+            if attempt == max_retries:
+                raise RuntimeError("Search outbox drain failed: search backend unavailable")
+            time.sleep(min(2 ** attempt, 30))
+
+        done = [row.id for row in rows
+                if (row.index_name, str(row.doc_id)) not in failed]
+        if not done:
+            backend.logger.error("Search outbox drain stopped: %s documents keep failing",
+                                 len(failed))
+            return drained
+        db.session.execute(sa.delete(search_outbox).where(search_outbox.c.id.in_(done)))
+        db.session.commit()
+        drained += len(actions) - len(failed)
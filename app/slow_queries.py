@@ -0,0 +1,148 @@
+import json
+import logging
+import os
+import re
+from collections import defaultdict
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+from time import perf_counter
+
+import sqlalchemy as sa
+from flask import Flask, has_request_context, request
+
+from app.db import db
+
+EXPLAIN_PREFIXES = {
+    "sqlite": "EXPLAIN QUERY PLAN ",
+    "postgresql": "EXPLAIN ",
+}
+# Statements on these tables carry password hashes and email addresses.
+REDACTED_TABLES = re.compile(r'\b(?:FROM|JOIN|UPDATE|INTO)\s+"?user"?(?![\w.])', re.IGNORECASE)
+
+
+class SlowQueryLog:
+    """Records statements slower than ``SLOW_QUERY_THRESHOLD`` seconds.
+
+    Each record is one JSON line in the rotating ``SLOW_QUERY_LOG`` file with
+    the statement, its bound parameters, the issuing endpoint and, for
+    SELECTs, the database's query plan. Statements on the ``user`` table are
+    logged without their parameters or plan, which would repeat them.
+    """
+
+    def __init__(self) -> None:
+        self.threshold = None
+        self.path = None
+        self.logger = logging.getLogger("app.slow_queries")
+
+    def init_app(self, app: Flask) -> None:
+        self.threshold = app.config["SLOW_QUERY_THRESHOLD"]
+        if self.threshold is None:
+            return
+
+        path = app.config["SLOW_QUERY_LOG"]
+        if path != self.path:
+            for handler in list(self.logger.handlers):
+                self.logger.removeHandler(handler)
+                handler.close()
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            handler = RotatingFileHandler(path, maxBytes=1024 * 1024,
+                                          backupCount=10, delay=True)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self.logger.addHandler(handler)
+            self.logger.setLevel(logging.INFO)
+            self.logger.propagate = False
+            self.path = path
+
+        with app.app_context():
+            engine = db.engine
+        if not sa.event.contains(engine, "before_cursor_execute", self.before_cursor_execute):
+            sa.event.listen(engine, "before_cursor_execute", self.before_cursor_execute)
+            sa.event.listen(engine, "after_cursor_execute", self.after_cursor_execute)
+
+    @staticmethod
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        context._slow_query_start_time = perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        duration = perf_counter() - context._slow_query_start_time
+        if self.threshold is None or duration < self.threshold:
+            return
+
+        plan = None
+        if REDACTED_TABLES.search(statement):
+            parameters = "[redacted]"
+        elif not executemany:
+            plan = self.explain(conn, statement, parameters)
+        self.logger.info(json.dumps({
+            "time": datetime.now(timezone.utc).isoformat(),
+            "duration_ms": round(duration * 1000, 3),
+            "endpoint": request.endpoint if has_request_context() else None,
+            "statement": statement,
+            "parameters": parameters,
+            "plan": plan,
+        }, default=str))
+
+    @staticmethod
+    def explain(conn, statement: str, parameters) -> list | None:
+        """Return the plan of ``statement``, run on the same connection.
+
+        On PostgreSQL a failed statement aborts the surrounding transaction,
+        so the EXPLAIN runs inside a savepoint that is rolled back on error.
+        """
+        prefix = EXPLAIN_PREFIXES.get(conn.dialect.name)
+        if prefix is None or not statement.lstrip().upper().startswith(("SELECT", "WITH")):
+            return None
+        savepoint = conn.dialect.name == "postgresql" and conn.in_transaction()
+        cursor = conn.connection.cursor()
+        try:
+            if savepoint:
+                cursor.execute("SAVEPOINT slow_query_explain")
+            try:
+                cursor.execute(prefix + statement, parameters)
+                plan = [" ".join(str(column) for column in row) for row in cursor.fetchall()]
+            except Exception as e:  # NOQA
+                if savepoint:
+                    cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+                plan = [f"EXPLAIN failed: {e}"]
+            if savepoint:
+                cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+            return plan
+        finally:
+            cursor.close()
+
+
+def summarize_slow_queries(path: str, limit: int = 10) -> list[dict]:
+    """Group the records of ``path`` and its rotated files by statement."""
+    stats = defaultdict(lambda: {"count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                                 "endpoints": set(), "plan": None})
+    directory, name = os.path.split(path)
+    directory = directory or "."
+    if not os.path.isdir(directory):
+        return []
+    for file_name in os.listdir(directory):
+        if file_name != name and not file_name.startswith(name + "."):
+            continue
+        with open(os.path.join(directory, file_name), encoding="utf-8") as log_file:
+            for line in log_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                statement = re.sub(r"\s+", " ", record["statement"]).strip()
+                entry = stats[statement]
+                entry["count"] += 1
+                entry["total_ms"] += record["duration_ms"]
+                entry["max_ms"] = max(entry["max_ms"], record["duration_ms"])
+                if record["endpoint"]:
+                    entry["endpoints"].add(record["endpoint"])
+                entry["plan"] = record["plan"] or entry["plan"]
+
+    offenders = [
+        {"statement": statement, **entry}
+        for statement, entry in stats.items()
+    ]
+    offenders.sort(key=lambda entry: entry["total_ms"], reverse=True)
+    return offenders[:limit]
+
+
+slow_query_log = SlowQueryLog()
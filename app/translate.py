@@ -1,18 +1,272 @@
-from functools import lru_cache
+import hashlib
+import logging
+import random
+import time
+from collections.abc import Iterator
+from datetime import datetime, timedelta, timezone
+from threading import Lock
 
 import requests
-from flask import current_app
+import sqlalchemy as sa
+from flask import Flask, current_app
+from requests.adapters import HTTPAdapter
 from flask_babel import _  # NOQA
 
+from app.cache import SingleFlight
+from app.db import UPSERTS, db
+from app.instrumentation import timed
+from app.metrics import TRANSLATIONS
 
-@lru_cache(maxsize=512)
-def translate(text: str, source_language: str, dest_language: str) -> str:
-    url = "https://api.cognitive.microsofttranslator.com/translate"
+translation_cache = sa.Table(
+    'translation_cache',
+    db.metadata,
+    sa.Column('key', sa.String(64), primary_key=True),
+    sa.Column('translation', sa.Text, nullable=False),
+    sa.Column('expires_at', sa.DateTime, nullable=False, index=True)
+)
+
+translation_flight = SingleFlight()
+logger = logging.getLogger("app.translate")
+
+# One in this many stored translations also evicts expired and surplus rows.
+PRUNE_EVERY = 100
+# Limits of a single request to the translator.
+MAX_BATCH_ITEMS = 1000
+MAX_BATCH_CHARS = 50000
+# Responses worth another attempt; anything else non-200 fails at once.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class TranslationError(Exception):
+    """The translation could not be obtained.
+
+    ``reason`` is "not_configured", "failed", or "unavailable" while the
+    circuit breaker keeps requests away from an unhealthy translator.
+    """
+
+    def __init__(self, reason: str) -> None:
+        super().__init__(reason)
+        self.reason = reason
+
+
+class CircuitBreaker:
+    """Fails fast once ``threshold`` consecutive calls have failed.
+
+    After ``cooldown`` seconds a single probe is let through; its success
+    closes the breaker again and its failure restarts the cooldown.
+    """
+
+    def __init__(self, threshold: int = 5, cooldown: float = 30) -> None:
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = Lock()
+
+    def configure(self, threshold: int, cooldown: float) -> None:
+        with self._lock:
+            self.threshold = threshold
+            self.cooldown = cooldown
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < self.cooldown:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+
+
+class Translator:
+    """Keep-alive HTTP client for the translator, shared by a worker's threads.
+
+    Requests time out after ``TRANSLATOR_CONNECT_TIMEOUT`` and
+    ``TRANSLATOR_READ_TIMEOUT`` seconds. Timeouts, connection errors and
+    ``RETRY_STATUSES`` are retried ``TRANSLATOR_MAX_RETRIES`` times with
+    jittered exponential backoff, and count towards the circuit breaker.
+    """
+
+    def __init__(self) -> None:
+        self.url = None
+        self.timeout = (3.05, 10)
+        self.max_retries = 2
+        self.retry_backoff = 0.5
+        self.breaker = CircuitBreaker()
+        self.session = None
+        self.logger = logger
+
+    def init_app(self, app: Flask) -> None:
+        self.url = app.config["MS_TRANSLATOR_URL"]
+        self.timeout = (app.config["TRANSLATOR_CONNECT_TIMEOUT"],
+                        app.config["TRANSLATOR_READ_TIMEOUT"])
+        self.max_retries = app.config["TRANSLATOR_MAX_RETRIES"]
+        self.retry_backoff = app.config["TRANSLATOR_RETRY_BACKOFF"]
+        self.breaker.configure(app.config["TRANSLATOR_BREAKER_THRESHOLD"],
+                               app.config["TRANSLATOR_BREAKER_COOLDOWN"])
+        if self.session is not None:
+            self.session.close()
+        self.session = self.create_session(app.config["TRANSLATOR_POOL_SIZE"])
+
+    @staticmethod
+    def create_session(pool_size: int) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def post(self, params: dict, headers: dict, json: list) -> requests.Response:
+        """Send one translator request and return its successful response.
+
+        Any answer outside ``RETRY_STATUSES`` shows the translator is up, so
+        it closes the breaker even when it is an error.
+        """
+        if not self.breaker.allow():
+            raise TranslationError("unavailable")
+
+        healthy = False
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response = self.session.post(self.url, params=params, headers=headers,
+                                                 json=json, timeout=self.timeout)
+                except requests.RequestException as e:
+                    self.logger.warning("Translator request failed: %s", e)
+                else:
+                    if response.status_code not in RETRY_STATUSES:
+                        healthy = True
+                        if response.status_code != 200:
+                            self.logger.error("Translator answered %s", response.status_code)
+                            raise TranslationError("failed")
+                        return response
+                    self.logger.warning("Translator answered %s", response.status_code)
+                if attempt < self.max_retries:
+                    time.sleep(self.retry_backoff * 2 ** attempt * random.uniform(0.5, 1.0))
+            raise TranslationError("failed")
+        finally:
+            if healthy:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+                if self.breaker.is_open:
+                    self.logger.error("Translator circuit open for %ss", self.breaker.cooldown)
+
+
+translator = Translator()
+
+
+def translation_key(text: str, source_language: str, dest_language: str) -> str:
+    payload = "\0".join((source_language, dest_language, text)).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+def load_cached_translations(keys: list[str]) -> dict[str, str]:
+    """Return the unexpired translations among ``keys`` in one query."""
+    with db.engine.connect() as connection:
+        rows = connection.execute(
+            sa.select(translation_cache.c.key, translation_cache.c.translation).where(
+                translation_cache.c.key.in_(keys),
+                translation_cache.c.expires_at > datetime.now(timezone.utc)
+            )
+        )
+        return {row.key: row.translation for row in rows}
+
+
+def store_translations(translations: dict[str, str]) -> None:
+    """Save ``translations`` for every worker, replacing expired or concurrent copies."""
+    expires_at = datetime.now(timezone.utc) + timedelta(
+        seconds=current_app.config["TRANSLATION_CACHE_TTL"])
+    rows = [
+        {"key": key, "translation": translation, "expires_at": expires_at}
+        for key, translation in translations.items()
+    ]
+    with db.engine.begin() as connection:
+        insert = UPSERTS.get(connection.dialect.name)
+        if insert is not None:
+            statement = insert(translation_cache)
+            connection.execute(
+                statement.on_conflict_do_update(
+                    index_elements=[translation_cache.c.key],
+                    set_={"translation": statement.excluded.translation,
+                          "expires_at": statement.excluded.expires_at}
+                ),
+                rows
+            )
+        else:
+            for row in rows:
+                updated = connection.execute(
+                    sa.update(translation_cache)
+                    .where(translation_cache.c.key == row["key"])
+                    .values(translation=row["translation"], expires_at=expires_at)
+                ).rowcount
+                if not updated:
+                    connection.execute(sa.insert(translation_cache).values(**row))
+        if random.randrange(PRUNE_EVERY) < len(rows):
+            prune_translation_cache(connection, current_app.config["TRANSLATION_CACHE_MAX_ENTRIES"])
+
+
+def prune_translation_cache(connection: sa.Connection, max_entries: int) -> int:
+    """Delete expired translations, then the ones closest to expiry beyond ``max_entries``."""
+    deleted = connection.execute(
+        sa.delete(translation_cache)
+        .where(translation_cache.c.expires_at <= datetime.now(timezone.utc))
+    ).rowcount
+    surplus = connection.scalar(
+        sa.select(sa.func.count()).select_from(translation_cache)) - max_entries
+    if surplus > 0:
+        oldest = sa.select(translation_cache.c.key) \
+            .order_by(translation_cache.c.expires_at) \
+            .limit(surplus) \
+            .scalar_subquery()
+        deleted += connection.execute(
+            sa.delete(translation_cache).where(translation_cache.c.key.in_(oldest))
+        ).rowcount
+    return deleted
+
+
+def translator_batches(texts: list[str]) -> Iterator[list[str]]:
+    """Split ``texts`` into runs the translator accepts in a single request."""
+    batch, size = [], 0
+    for text in texts:
+        if batch and (len(batch) == MAX_BATCH_ITEMS or size + len(text) > MAX_BATCH_CHARS):
+            yield batch
+            batch, size = [], 0
+        batch.append(text)
+        size += len(text)
+    if batch:
+        yield batch
+
+
+def request_translations(texts: list[str], source_language: str, dest_language: str) -> list[str]:
+    """Translate every text in ``texts`` with as few upstream requests as the limits allow."""
     api_key = current_app.config.get("MS_TRANSLATOR_KEY")
     api_region = current_app.config.get("MS_TRANSLATOR_REGION")
 
     if api_key is None or api_region is None:
-        return _('Error: the translation service is not configured.')
+        TRANSLATIONS.labels(outcome="not_configured").inc(len(texts))
+        raise TranslationError("not_configured")
 
     auth = {
         "Ocp-Apim-Subscription-Key": api_key,
@@ -25,14 +279,86 @@ def translate(text: str, source_language: str, dest_language: str) -> str:
         "to": dest_language,
     }
 
-    response = requests.post(
-        url,
-        params=params,
-        headers=auth,
-        json=[{"Text": text}]
-    )
+    translations = []
+    for batch in translator_batches(texts):
+        try:
+            with timed("translate"):
+                response = translator.post(params, auth, [{"Text": text} for text in batch])
+        except TranslationError as e:
+            TRANSLATIONS.labels(outcome="error" if e.reason == "failed" else e.reason) \
+                .inc(len(batch))
+            raise
+
+        TRANSLATIONS.labels(outcome="success").inc(len(batch))
+        translations += [item["translations"][0]["text"] for item in response.json()]
+    return translations
 
-    if response.status_code != 200:
-        return _('Error: the translation service failed.')
 
-    return response.json()[0]["translations"][0]["text"]
+def fetch_translations(
+        keys: list[str],
+        texts: list[str],
+        source_language: str,
+        dest_language: str
+) -> list[str]:
+    translations = request_translations(texts, source_language, dest_language)
+    try:
+        store_translations(dict(zip(keys, translations)))
+    except sa.exc.SQLAlchemyError as e:
+        logger.warning("Could not cache %s translation(s): %s", len(translations), e)
+    return translations
+
+
+def translation_error_message(error: TranslationError) -> str:
+    if error.reason == "not_configured":
+        return _('Error: the translation service is not configured.')
+    return _('Error: the translation service failed.')
+
+
+def lookup_translations(
+        items: list[tuple[str, str]],
+        dest_language: str
+) -> list[str | TranslationError]:
+    """Translate ``(text, source_language)`` pairs into ``dest_language``.
+
+    Results come back in order, one per item, with a ``TranslationError``
+    in place of each translation that failed. Cached texts are read in one
+    query and the rest are sent upstream together, one request per source
+    language. A failed request only fails its own items.
+    """
+    keys = [translation_key(text, source_language, dest_language)
+            for text, source_language in items]
+    results = load_cached_translations(keys) if keys else {}
+    if results:
+        TRANSLATIONS.labels(outcome="cached").inc(
+            sum(1 for key in keys if key in results))
+
+    missing = {}
+    for key, (text, source_language) in zip(keys, items):
+        if key not in results:
+            missing.setdefault(source_language, {})[key] = text
+    for source_language, texts in missing.items():
+        try:
+            translations = translation_flight.do(
+                tuple(texts), fetch_translations,
+                list(texts), list(texts.values()), source_language, dest_language)
+        except TranslationError as e:
+            translations = [e] * len(texts)
+        results.update(zip(texts, translations))
+    return [results[key] for key in keys]
+
+
+def translate_batch(items: list[tuple[str, str]], dest_language: str) -> list[str]:
+    """Like ``lookup_translations``, with failures as localized error messages."""
+    return [
+        translation_error_message(result) if isinstance(result, TranslationError) else result
+        for result in lookup_translations(items, dest_language)
+    ]
+
+
+def translate(text: str, source_language: str, dest_language: str) -> str:
+    """Translate ``text``, sharing results between workers through ``translation_cache``.
+
+    Concurrent requests for the same translation in a worker make a single
+    upstream call. Failures are reported but never cached.
+    """
+    return translate_batch([(text, source_language)], dest_language)[0]
@@ -13,7 +13,12 @@ class Config:
     )
     LOGIN_VIEW = "auth.login"
     LOGIN_MESSAGE = "Please log in to access this page"
+    USER_CACHE_SIZE = 1024
+    # Each worker keeps its own user cache and only the worker that commits a
+    # change to a user drops its entry; the others may serve it for this long.
+    USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", 5))
     POSTS_PER_PAGE = 3
+    FEED_PAGINATION = os.environ.get("FEED_PAGINATION", "keyset")
     MAIL_SERVER = os.environ.get("MAIL_SERVER")
     MAIL_PORT = os.environ.get("MAIL_PORT")
     JWT_EXPIRES_IN = 600
@@ -21,7 +26,49 @@ class Config:
     LANGUAGES = ["en", "uk"]
     MS_TRANSLATOR_KEY = os.environ.get("MS_TRANSLATOR_KEY")
     MS_TRANSLATOR_REGION = os.environ.get("MS_TRANSLATOR_REGION")
+    MS_TRANSLATOR_URL = os.environ.get(
+        "MS_TRANSLATOR_URL", "https://api.cognitive.microsofttranslator.com/translate")
+    TRANSLATOR_CONNECT_TIMEOUT = 3.05
+    TRANSLATOR_READ_TIMEOUT = 10
+    TRANSLATOR_MAX_RETRIES = 2
+    TRANSLATOR_RETRY_BACKOFF = 0.5
+    TRANSLATOR_BREAKER_THRESHOLD = 5
+    TRANSLATOR_BREAKER_COOLDOWN = 30
+    TRANSLATOR_POOL_SIZE = 10
+    TRANSLATION_CACHE_TTL = int(os.environ.get("TRANSLATION_CACHE_TTL", 30 * 24 * 3600))
+    TRANSLATION_CACHE_MAX_ENTRIES = 100000
+    TRANSLATE_BATCH_MAX_ITEMS = 100
+    PRETRANSLATE_MODE = os.environ.get("PRETRANSLATE_MODE", "async")
+    PRETRANSLATE_QUEUE_SIZE = 1000
+    LANGUAGE_DETECTION_MODE = os.environ.get("LANGUAGE_DETECTION_MODE", "async")
+    LANGUAGE_DETECTION_QUEUE_SIZE = 1000
     ELASTICSEARCH_URL = os.environ.get("ELASTICSEARCH_URL")
+    SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND")
+    SEARCH_BULK_MAX_CHUNK_BYTES = int(os.environ.get("SEARCH_BULK_MAX_CHUNK_BYTES", 10 * 1024 * 1024))
+    SEARCH_BULK_MAX_RETRIES = 5
+    SEARCH_BULK_THREADS = int(os.environ.get("SEARCH_BULK_THREADS", 1))
+    SEARCH_TRACK_TOTAL_HITS = 1000
+    SEARCH_PIT_KEEP_ALIVE = "5m"
+    SEARCH_CACHE_SIZE = 1024
+    SEARCH_CACHE_TTL = 60
+    SUGGEST_CACHE_SIZE = 4096
+    SUGGEST_CACHE_TTL = 10
+    SUGGEST_LIMIT = 5
+    SEARCH_INDEX_DIR = os.environ.get("SEARCH_INDEX_DIR", os.path.join(basedir, "search_index"))
+    SEARCH_INDEXING_MODE = os.environ.get("SEARCH_INDEXING_MODE", "async")
+    SEARCH_INDEXING_QUEUE_SIZE = 1000
+    SEARCH_INDEXING_WORKERS = 2
+    LAST_SEEN_FLUSH_INTERVAL = int(os.environ.get("LAST_SEEN_FLUSH_INTERVAL", 60))
+    LAST_SEEN_BATCH_SIZE = 500
+    INSTRUMENTATION_ENABLED = os.environ.get("INSTRUMENTATION_ENABLED", "").lower() in ("1", "true")
+    INSTRUMENTATION_QUERY_THRESHOLD = int(os.environ.get("INSTRUMENTATION_QUERY_THRESHOLD", 20))
+    # Off unless set; the log holds statements and their parameters.
+    SLOW_QUERY_THRESHOLD = (float(os.environ["SLOW_QUERY_THRESHOLD"])
+                            if os.environ.get("SLOW_QUERY_THRESHOLD") else None)
+    SLOW_QUERY_LOG = os.environ.get("SLOW_QUERY_LOG", os.path.join("logs", "slow_queries.log"))
+    METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "").lower() in ("1", "true")
+    # When set, /metrics requires an "Authorization: Bearer <token>" header.
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
 
 
 class HerokuConfig(Config):
@@ -34,3 +81,5 @@ class TestConfig(Config):
     TESTING = True
     SECRET_KEY = "testing"
     SQLALCHEMY_DATABASE_URI = "sqlite://"
+    SLOW_QUERY_THRESHOLD = None
+    LANGUAGE_DETECTION_MODE = "off"
@@ -0,0 +1,20 @@
+import os
+import shutil
+
+# Every worker writes its Prometheus samples here so that /metrics can
+# aggregate them; it must be set before the app (and prometheus_client)
+# is imported by the workers.
+multiproc_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "prometheus_multiproc")
+)
+
+
+def on_starting(server) -> None:
+    shutil.rmtree(multiproc_dir, ignore_errors=True)
+    os.makedirs(multiproc_dir)
+
+
+def child_exit(server, worker) -> None:
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,45 @@
+"""timeline table
+
+Revision ID: 4f2c7d9e1a63
+Revises: 1b5cff4a9e33
+Create Date: 2026-10-18 10:12:31.482015
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f2c7d9e1a63'
+down_revision = '1b5cff4a9e33'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('timeline',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['post_id'], ['post.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'post_id')
+    )
+    with op.batch_alter_table('timeline', schema=None) as batch_op:
+        batch_op.create_index('ix_timeline_user_id_timestamp', ['user_id', 'timestamp'], unique=False)
+
+    # Backfill every user's home feed from the existing posts and follows.
+    op.execute(
+        "INSERT INTO timeline (user_id, post_id, timestamp) "
+        "SELECT user_id, id, timestamp FROM post "
+        "UNION "
+        "SELECT followers.follower_id, post.id, post.timestamp FROM post "
+        "JOIN followers ON followers.followed_id = post.user_id"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('timeline', schema=None) as batch_op:
+        batch_op.drop_index('ix_timeline_user_id_timestamp')
+
+    op.drop_table('timeline')
@@ -0,0 +1,34 @@
+"""follow counters
+
+Revision ID: 8c3e5a1f0b27
+Revises: 4f2c7d9e1a63
+Create Date: 2026-10-18 11:04:52.913370
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c3e5a1f0b27'
+down_revision = '4f2c7d9e1a63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('num_followers', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('num_following', sa.Integer(), server_default='0', nullable=False))
+
+    op.execute(
+        'UPDATE "user" SET '
+        'num_followers = (SELECT count(*) FROM followers WHERE followers.followed_id = "user".id), '
+        'num_following = (SELECT count(*) FROM followers WHERE followers.follower_id = "user".id)'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('num_following')
+        batch_op.drop_column('num_followers')
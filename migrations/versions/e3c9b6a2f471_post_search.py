@@ -0,0 +1,42 @@
+"""post full-text search table
+
+Revision ID: e3c9b6a2f471
+Revises: d5a8f3b0e614
+Create Date: 2026-10-18 16:25:09.418377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3c9b6a2f471'
+down_revision = 'd5a8f3b0e614'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS post_search USING fts5("
+            "body, tokenize='unicode61 remove_diacritics 2')"
+        )
+        op.execute("INSERT INTO post_search (rowid, body) SELECT id, body FROM post")
+    elif dialect == 'postgresql':
+        op.create_table('post_search',
+        sa.Column('doc_id', sa.Integer(), nullable=False),
+        sa.Column('document', sa.dialects.postgresql.TSVECTOR(), nullable=False),
+        sa.PrimaryKeyConstraint('doc_id')
+        )
+        op.create_index('ix_post_search_document', 'post_search', ['document'],
+                        unique=False, postgresql_using='gin')
+        op.execute(
+            "INSERT INTO post_search (doc_id, document) "
+            "SELECT id, to_tsvector('simple', coalesce(body, '')) FROM post"
+        )
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS post_search")
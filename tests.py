@@ -1,8 +1,65 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime, timezone, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import unittest
+from collections import Counter
+from unittest import mock
+
+import sqlalchemy as sa
+from langdetect import detect
 from werkzeug.security import generate_password_hash
 from app import db, create_app
-from app.models import User, Post
+from config import TestConfig
+from app.models import User, Post, PostTranslation
+from app.extensions import load_user
+from app.last_seen import last_seen_buffer
+from app.slow_queries import summarize_slow_queries
+from app.pagination import keyset_paginate, offset_paginate
+from app.search import (
+    bump_generations,
+    db_search_service,
+    drain_search_outbox,
+    es_service,
+    inverted_index_service,
+    search_outbox
+)
+from app.search.inverted import InvertedIndex, Segment, tokenize
+from app.translate import (
+    PRUNE_EVERY,
+    store_translations,
+    translate,
+    translate_batch,
+    translation_cache,
+    translation_key,
+    translator
+)
+
+
+class InstrumentedTestConfig(TestConfig):
+    INSTRUMENTATION_ENABLED = True
+
+
+class TranslatorTestConfig(TestConfig):
+    MS_TRANSLATOR_KEY = "key"
+    MS_TRANSLATOR_REGION = "region"
+    TRANSLATOR_MAX_RETRIES = 0
+    PRETRANSLATE_MODE = "sync"
+    LANGUAGE_DETECTION_MODE = "sync"
+
+
+class MetricsTestConfig(TestConfig):
+    METRICS_ENABLED = True
+    METRICS_TOKEN = "scraper"
+
+
+class SlowQueryTestConfig(TestConfig):
+    SLOW_QUERY_THRESHOLD = 0
+    SLOW_QUERY_LOG = os.path.join(tempfile.mkdtemp(), "slow_queries.log")
 
 
 class UserModelCase(unittest.TestCase):
@@ -71,6 +128,22 @@ class UserModelCase(unittest.TestCase):
         self.assertEqual(u1.following_count(), 0)
         self.assertEqual(u2.followers_count(), 0)
 
+    def test_recount_follows(self) -> None:
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        u1.follow(u2)
+        db.session.commit()
+
+        u2.num_followers = 5
+        db.session.commit()
+        self.assertEqual(User.recount_follows(), 1)
+        db.session.commit()
+        self.assertEqual(u2.followers_count(), 1)
+        self.assertEqual(u1.following_count(), 1)
+        self.assertEqual(User.recount_follows(), 0)
+
     def test_follow_posts(self) -> None:
         u1 = User(username='john', email='john@example.com')
         u2 = User(username='susan', email='susan@example.com')
@@ -105,6 +178,925 @@ class UserModelCase(unittest.TestCase):
         self.assertEqual(f3, [p3, p4])
         self.assertEqual(f4, [p4])
 
+    def test_timeline_fan_out(self) -> None:
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+
+        u1.follow(u2)
+        db.session.commit()
+
+        now = datetime.now(timezone.utc)
+        p1 = Post(body="post from john", author=u1,
+                  timestamp=now + timedelta(seconds=1))
+        p2 = Post(body="post from susan", author=u2,
+                  timestamp=now + timedelta(seconds=2))
+        db.session.add_all([p1, p2])
+        db.session.commit()
+
+        self.assertEqual(db.session.scalars(u1.following_posts()).all(), [p2, p1])
+        self.assertEqual(db.session.scalars(u2.following_posts()).all(), [p2])
+
+        u1.unfollow(u2)
+        db.session.commit()
+        self.assertEqual(db.session.scalars(u1.following_posts()).all(), [p1])
+
+        db.session.delete(p1)
+        db.session.commit()
+        self.assertEqual(db.session.scalars(u1.following_posts()).all(), [])
+
+    def test_index_changes_in_one_background_bulk(self) -> None:
+        self.app.config["SEARCH_BACKEND"] = "elasticsearch"
+        u1 = User(username='john', email='john@example.com')
+        with mock.patch.object(es_service, "es_client", mock.Mock()), \
+                mock.patch("app.search.elasticsearch.helpers.bulk", return_value=(2, [])) as bulk:
+            db.session.add_all([Post(body="one", author=u1),
+                                Post(body="two", author=u1)])
+            db.session.commit()
+            es_service.indexing_worker.join()
+        bulk.assert_called_once()
+        actions = bulk.call_args.args[1]
+        self.assertEqual(sorted(a["_source"]["body"] for a in actions),
+                         ["one", "two"])
+        self.assertEqual(db.session.scalar(
+            sa.select(sa.func.count()).select_from(search_outbox)), 0)
+
+    def test_failed_documents_stay_in_outbox_behind_alias(self) -> None:
+        self.app.config["SEARCH_BACKEND"] = "elasticsearch"
+        u1 = User(username='john', email='john@example.com')
+        error = {"index": {"_index": "post-20261018120000000000", "_id": "1",
+                           "status": 400, "error": {"type": "mapper_parsing_exception"}}}
+        with mock.patch.object(es_service, "es_client", mock.Mock()), \
+                mock.patch.object(es_service, "indexing_mode", "sync"), \
+                mock.patch("app.search.elasticsearch.helpers.bulk",
+                           return_value=(1, [error])):
+            db.session.add_all([Post(body="one", author=u1),
+                                Post(body="two", author=u1)])
+            db.session.commit()
+        self.assertEqual(db.session.execute(
+            sa.select(search_outbox.c.index_name, search_outbox.c.doc_id)).all(),
+            [("post", 1)])
+
+    def test_drain_search_outbox(self) -> None:
+        self.app.config["SEARCH_BACKEND"] = "elasticsearch"
+        u1 = User(username='john', email='john@example.com')
+        p1 = Post(body="first", author=u1)
+        p2 = Post(body="second", author=u1)
+        with mock.patch.object(es_service, "es_client", mock.Mock()), \
+                mock.patch.object(es_service, "indexing_mode", "sync"), \
+                mock.patch.object(es_service, "bulk", return_value=None):
+            db.session.add_all([p1, p2])
+            db.session.commit()
+            p1.body = "first, edited"
+            db.session.commit()
+            db.session.delete(p2)
+            db.session.commit()
+        self.assertEqual(db.session.scalar(
+            sa.select(sa.func.count()).select_from(search_outbox)), 4)
+
+        with mock.patch.object(es_service, "es_client", mock.Mock()), \
+                mock.patch("app.search.elasticsearch.helpers.bulk", return_value=(2, [])) as bulk:
+            self.assertEqual(drain_search_outbox(), 2)
+        actions = sorted(bulk.call_args.args[1], key=lambda a: a["_id"])
+        self.assertEqual(actions[0]["_source"], {"body": "first, edited"})
+        self.assertEqual(actions[1]["_op_type"], "delete")
+        self.assertEqual(db.session.scalar(
+            sa.select(sa.func.count()).select_from(search_outbox)), 0)
+
+    def test_reindex_partitions_and_swaps_alias(self) -> None:
+        self.app.config["SEARCH_BACKEND"] = "elasticsearch"
+        u1 = User(username='john', email='john@example.com')
+        db.session.add_all([Post(body=f"post {i}", author=u1) for i in range(5)])
+        db.session.commit()
+        sent = []
+
+        def bulk(client, actions, **kwargs):
+            sent.extend(actions)
+            return len(actions), []
+
+        es = mock.Mock()
+        es.indices.exists_alias.return_value = True
+        es.indices.get_alias.return_value = {"post-old": {}}
+        with mock.patch.object(es_service, "es_client", es), \
+                mock.patch("app.search.elasticsearch.helpers.bulk", bulk):
+            report = Post.reindex(workers=1, partition_size=2)
+        self.assertEqual((report.indexed, report.failed), (5, 0))
+
+        new_index = es.indices.create.call_args.kwargs["index"]
+        self.assertTrue(new_index.startswith("post-"))
+        self.assertEqual(sorted(a["_id"] for a in sent), [1, 2, 3, 4, 5])
+        self.assertEqual(sent[0]["_source"], {"body": sent[0]["_source"]["body"]})
+        self.assertEqual(es.indices.update_aliases.call_args.kwargs["body"], {
+            "actions": [
+                {"add": {"index": new_index, "alias": "post"}},
+                {"remove": {"index": "post-old", "alias": "post"}},
+            ]
+        })
+        es.indices.delete.assert_called_once_with(index="post-old", ignore=[404])
+
+    def test_adaptive_bulk_retries_rejections(self) -> None:
+        docs = [{"_index": "post", "_id": i, "_source": {"body": "x" * 100}}
+                for i in range(1, 7)]
+        rejected = {"index": {"_index": "post-1", "_id": "2", "status": 429}}
+        invalid = {"index": {"_index": "post-1", "_id": "3", "status": 400,
+                             "error": "mapper_parsing_exception"}}
+        responses = [(1, [rejected, invalid]), (1, []), (3, [])]
+        requests = []
+
+        def bulk(client, actions, **kwargs):
+            requests.append([a["_id"] for a in actions])
+            return responses.pop(0)
+
+        with mock.patch.object(es_service, "es_client", mock.Mock()), \
+                mock.patch.object(es_service, "bulk_max_chunk_bytes", 700), \
+                mock.patch("app.search.elasticsearch.helpers.bulk", bulk), \
+                mock.patch("app.search.elasticsearch.time.sleep") as sleep:
+            report = es_service.stream_documents_to_index(iter(docs), threads=1)
+        self.assertEqual(requests, [[1, 2, 3], [2], [4, 5, 6]])
+        sleep.assert_called_once()
+        self.assertEqual((report.indexed, report.failed, report.retried), (5, 1, 1))
+
+        def parallel_bulk(client, actions, **kwargs):
+            for action in actions:
+                if action["_id"] == 2:
+                    yield False, rejected
+                elif action["_id"] == 3:
+                    yield False, invalid
+                else:
+                    yield True, {"index": {"_id": str(action["_id"]), "status": 201}}
+
+        with mock.patch.object(es_service, "es_client", mock.Mock()), \
+                mock.patch("app.search.elasticsearch.helpers.parallel_bulk", parallel_bulk), \
+                mock.patch("app.search.elasticsearch.helpers.bulk",
+                           return_value=(1, [])) as retry:
+            report = es_service.stream_documents_to_index(iter(docs), threads=4)
+        self.assertEqual([a["_id"] for a in retry.call_args.args[1]], [2])
+        self.assertEqual((report.indexed, report.failed, report.retried), (5, 1, 1))
+
+    def test_incremental_reindex_resumes_from_checkpoint(self) -> None:
+        self.app.config["SEARCH_BACKEND"] = "elasticsearch"
+        u1 = User(username='john', email='john@example.com')
+        db.session.add_all([Post(body=f"post {i}", author=u1) for i in range(3)])
+        db.session.commit()
+
+        with mock.patch.object(es_service, "bulk", return_value=set()) as bulk:
+            self.assertEqual(Post.reindex_incremental(chunk_size=2), 3)
+            self.assertEqual(bulk.call_count, 2)
+            self.assertEqual(Post.load_checkpoint(), 3)
+
+            db.session.add(Post(body="post 3", author=u1))
+            db.session.commit()
+            bulk.reset_mock()
+            self.assertEqual(Post.reindex_incremental(chunk_size=2), 1)
+            self.assertEqual([a["_id"] for a in bulk.call_args.args[0]], [4])
+
+        with mock.patch.object(es_service, "bulk", return_value=None):
+            db.session.add(Post(body="post 4", author=u1))
+            db.session.commit()
+            with self.assertRaises(RuntimeError):
+                Post.reindex_incremental()
+        self.assertEqual(Post.load_checkpoint(), 4)
+
+    def test_database_full_text_search(self) -> None:
+        u1 = User(username='john', email='john@example.com')
+        p1 = Post(body="the quick brown fox", author=u1)
+        p2 = Post(body="a lazy dog", author=u1)
+        p3 = Post(body="fox and dog", author=u1)
+        db.session.add_all([p1, p2, p3])
+        db.session.commit()
+
+        posts, total = Post.search("fox", 1, 10)
+        self.assertEqual(total, 2)
+        self.assertEqual(sorted(p.id for p in posts), [p1.id, p3.id])
+
+        p1.body = "the quick brown cat"
+        db.session.delete(p3)
+        db.session.commit()
+        posts, total = Post.search("fox", 1, 10)
+        self.assertEqual(total, 0)
+        posts, total = Post.search("cat dog", 1, 10)
+        self.assertEqual(sorted(p.id for p in posts), [p1.id, p2.id])
+
+        Post.reindex()
+        self.assertEqual(Post.search("dog", 1, 10)[1], 1)
+        self.assertEqual(db.session.scalar(
+            sa.select(sa.func.count()).select_from(search_outbox)), 0)
+
+    def test_search_results_are_cached_per_generation(self) -> None:
+        u1 = User(username='john', email='john@example.com')
+        db.session.add(Post(body="cached fox", author=u1))
+        db.session.commit()
+
+        with mock.patch.object(db_search_service, "query_index",
+                               wraps=db_search_service.query_index) as query_index:
+            self.assertEqual(Post.search("fox", 1, 10)[1], 1)
+            self.assertEqual(Post.search("  FOX ", 1, 10)[1], 1)
+            self.assertEqual(query_index.call_count, 1)
+
+            db.session.add(Post(body="another fox", author=u1))
+            db.session.commit()
+            self.assertEqual(Post.search("fox", 1, 10)[1], 2)
+            self.assertEqual(query_index.call_count, 2)
+
+            # Another worker's commit only reaches this one through the database.
+            with db.engine.begin() as connection:
+                bump_generations(connection, [Post.get_index_name()])
+            self.assertEqual(Post.search("fox", 1, 10)[1], 2)
+            self.assertEqual(query_index.call_count, 3)
+            self.assertEqual(Post.search("fox", 1, 10)[1], 2)
+            self.assertEqual(query_index.call_count, 3)
+
+    def test_search_after_cursors(self) -> None:
+        self.app.config["SEARCH_BACKEND"] = "elasticsearch"
+        u1 = User(username='john', email='john@example.com')
+        posts = [Post(body=f"fox {i}", author=u1) for i in range(3)]
+        db.session.add_all(posts)
+        db.session.commit()
+
+        def hits(*ids):
+            return {"pit_id": "pit-2", "hits": {
+                "total": {"value": 3, "relation": "eq"},
+                "hits": [{"_id": str(id_), "sort": [1.0, id_]} for id_ in ids]
+            }}
+
+        es = mock.Mock()
+        es.open_point_in_time.return_value = {"id": "pit-1"}
+        es.search.return_value = hits(3, 2, 1)
+        with mock.patch.object(es_service, "es_client", es):
+            page, total = Post.search_page("fox", 2)
+            self.assertEqual((page.items, total), ([posts[2], posts[1]], 3))
+            self.assertFalse(page.has_prev)
+            body = es.search.call_args.kwargs["body"]
+            self.assertEqual(es.search.call_args.kwargs["index"], "post")
+            self.assertNotIn("pit", body)
+            self.assertEqual(body["size"], 3)
+            self.assertEqual(body["track_total_hits"], 1000)
+            self.assertNotIn("search_after", body)
+
+            es.search.return_value = hits(1)
+            page, _ = Post.search_page("fox", 2, after=page.next_cursor)
+            self.assertEqual(page.items, [posts[0]])
+            self.assertFalse(page.has_next)
+            body = es.search.call_args.kwargs["body"]
+            self.assertEqual((body["pit"]["id"], body["from"]), ("pit-1", 2))
+            self.assertEqual(body["sort"], [{"_score": "desc"}, {"_shard_doc": "asc"}])
+
+            es.search.return_value = hits(2, 3)
+            page, _ = Post.search_page("fox", 2, before=page.prev_cursor)
+            self.assertEqual(page.items, [posts[2], posts[1]])
+            body = es.search.call_args.kwargs["body"]
+            self.assertEqual(body["sort"], [{"_score": "asc"}, {"_shard_doc": "desc"}])
+            self.assertEqual((body["pit"]["id"], body["search_after"]), ("pit-2", [1.0, 1]))
+        es.open_point_in_time.assert_called_once()
+
+        es.reset_mock()
+        es.search.return_value = hits(3, 2)
+        with mock.patch.object(es_service, "es_client", es):
+            page, _ = Post.search_page("single page", 2)
+        self.assertFalse(page.has_next)
+        es.search.assert_called_once()
+        es.open_point_in_time.assert_not_called()
+
+    def test_page_cursors_without_native_search_after(self) -> None:
+        u1 = User(username='john', email='john@example.com')
+        db.session.add_all([Post(body=f"fox {i}", author=u1) for i in range(3)])
+        db.session.commit()
+
+        page, total = Post.search_page("fox", 2)
+        self.assertEqual((len(page.items), total), (2, 3))
+        page, _ = Post.search_page("fox", 2, after=page.next_cursor)
+        self.assertEqual(len(page.items), 1)
+        self.assertFalse(page.has_next)
+        page, _ = Post.search_page("fox", 2, before=page.prev_cursor)
+        self.assertEqual(len(page.items), 2)
+        self.assertFalse(page.has_prev)
+
+    def test_inverted_index_search(self) -> None:
+        self.app.config["SEARCH_BACKEND"] = "inverted"
+        self.app.config["SEARCH_INDEX_DIR"] = tempfile.mkdtemp()
+        # The in-memory database has a single connection, which the
+        # background indexer must not share with the test.
+        self.app.config["SEARCH_INDEXING_MODE"] = "sync"
+        inverted_index_service.init_app(self.app)
+        self.assertEqual(tokenize("The Cats are sleeping", "en"), ["cat", "sleeping"])
+
+        u1 = User(username='john', email='john@example.com')
+        p1 = Post(body="cats and dogs", author=u1, language="en")
+        p2 = Post(body="a cat", author=u1, language="en")
+        p3 = Post(body="кіт і собака", author=u1, language="uk")
+        db.session.add_all([p1, p2, p3])
+        db.session.commit()
+
+        posts, total = Post.search("cat", 1, 10)
+        self.assertEqual(total, 2)
+        self.assertEqual(list(posts), [p2, p1])
+        self.assertEqual(list(Post.search("собака", 1, 10)[0]), [p3])
+
+        p2.body = "a dog"
+        db.session.delete(p3)
+        db.session.commit()
+        self.assertEqual(list(Post.search("cat", 1, 10)[0]), [p1])
+        self.assertEqual(Post.search("собака", 1, 10)[1], 0)
+
+        # Another worker sees the changes through the shared files.
+        index = InvertedIndex(inverted_index_service.get_index("post").directory)
+        self.assertEqual(sorted(index.search({"dog"})), [p1.id, p2.id])
+
+        for i in range(InvertedIndex.MERGE_FACTOR + 1):
+            db.session.add(Post(body=f"dog {i}", author=u1, language="en"))
+            db.session.commit()
+        index.refresh()
+        self.assertLess(len(index.segments), InvertedIndex.MERGE_FACTOR)
+        self.assertEqual(Post.search("dog", 1, 5)[1], 13)
+
+        Post.reindex()
+        index.refresh()
+        self.assertEqual(len(index.segments), 1)
+        self.assertEqual(Post.search("dog", 3, 5)[1], 13)
+        self.assertEqual(len(list(Post.search("dog", 3, 5)[0])), 3)
+
+    def test_inverted_index_tiered_merges(self) -> None:
+        directory = tempfile.mkdtemp()
+        index, other_worker = InvertedIndex(directory), InvertedIndex(directory)
+        for doc_id in range(1, 26):
+            index.apply({doc_id: Counter({"dog": 1, f"n{doc_id}": 1})})
+        index.apply({3: None, 4: Counter({"cat": 1})})
+        self.assertEqual(len(index.segments), 26)
+
+        merge_segments = Segment.merge
+
+        def merge_while_deleting(path, sources):
+            other_worker.apply({5: None})
+            return merge_segments(path, sources)
+
+        with mock.patch.object(Segment, "merge", side_effect=merge_while_deleting):
+            self.assertTrue(index.merge())
+        while index.merge():
+            pass
+        sizes = sorted(len(segment.doc_ids) - len(dead) for segment, dead in index.segments)
+        self.assertLess(len(sizes), InvertedIndex.MERGE_FACTOR)
+        self.assertEqual(sum(sizes), 23)
+        self.assertEqual(index.doc_count, 23)
+
+        other_worker.refresh()
+        self.assertEqual(sorted(other_worker.search({"dog"})),
+                         [i for i in range(1, 26) if i not in (3, 4, 5)])
+        self.assertEqual(list(other_worker.search({"cat"})), [4])
+        self.assertEqual(list(other_worker.search({"n17"})), [17])
+        self.assertEqual(sorted(name for name in os.listdir(directory) if name.endswith(".seg")),
+                         sorted(segment.name for segment, _ in index.segments))
+
+    def test_keyset_pagination(self) -> None:
+        u1 = User(username='john', email='john@example.com')
+        now = datetime.now(timezone.utc)
+        posts = [
+            Post(body=f"post {i}", author=u1,
+                 timestamp=now + timedelta(seconds=i // 2))
+            for i in range(5)
+        ]
+        db.session.add_all(posts)
+        db.session.commit()
+        newest_first = sorted(posts, key=lambda p: (p.timestamp, p.id),
+                              reverse=True)
+        query = sa.select(Post)
+        order_by = (Post.timestamp, Post.id)
+
+        page1 = keyset_paginate(query, order_by, per_page=2)
+        self.assertEqual(page1.items, newest_first[:2])
+        self.assertFalse(page1.has_prev)
+        self.assertTrue(page1.has_next)
+
+        page2 = keyset_paginate(query, order_by, per_page=2,
+                                after=page1.next_cursor)
+        self.assertEqual(page2.items, newest_first[2:4])
+
+        page3 = keyset_paginate(query, order_by, per_page=2,
+                                after=page2.next_cursor)
+        self.assertEqual(page3.items, newest_first[4:])
+        self.assertFalse(page3.has_next)
+
+        back = keyset_paginate(query, order_by, per_page=2,
+                               before=page3.prev_cursor)
+        self.assertEqual(back.items, newest_first[2:4])
+        self.assertTrue(back.has_prev)
+        self.assertEqual(
+            keyset_paginate(query, order_by, per_page=2, after="garbage").items,
+            newest_first[:2]
+        )
+
+    def test_offset_pagination_without_count(self) -> None:
+        u1 = User(username='john', email='john@example.com')
+        db.session.add_all([Post(body=f"post {i}", author=u1) for i in range(3)])
+        db.session.commit()
+        query = sa.select(Post).order_by(Post.id)
+
+        page1 = offset_paginate(query, page=1, per_page=2)
+        self.assertEqual(len(page1.items), 2)
+        self.assertTrue(page1.has_next)
+        page2 = offset_paginate(query, page=2, per_page=2)
+        self.assertEqual(len(page2.items), 1)
+        self.assertFalse(page2.has_next)
+
+
+class FeedQueryCountCase(unittest.TestCase):
+    max_queries_per_page = 10
+
+    def setUp(self) -> None:
+        self.app = create_app("config.TestConfig")
+        self.app.config["POSTS_PER_PAGE"] = 20
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.user = User(username='john', email='john@example.com')
+        authors = [
+            User(username=f'author{i}', email=f'author{i}@example.com')
+            for i in range(self.app.config["POSTS_PER_PAGE"])
+        ]
+        db.session.add_all([self.user, *authors])
+        db.session.commit()
+        for author in authors:
+            self.user.follow(author)
+        db.session.add_all([
+            Post(body=f"post from {author.username}", author=author)
+            for author in authors
+        ])
+        db.session.commit()
+        with self.client.session_transaction() as session:
+            session["_user_id"] = str(self.user.id)
+            session["_fresh"] = True
+
+    def tearDown(self) -> None:
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    @contextmanager
+    def assertMaxQueries(self, max_queries: int):
+        statements = []
+
+        def count_query(conn, cursor, statement, *args) -> None:
+            statements.append(statement)
+
+        sa.event.listen(db.engine, "before_cursor_execute", count_query)
+        try:
+            yield statements
+        finally:
+            sa.event.remove(db.engine, "before_cursor_execute", count_query)
+        self.assertLessEqual(
+            len(statements), max_queries,
+            "Too many queries:\n" + "\n".join(statements)
+        )
+
+    def test_feeds_load_authors_eagerly(self) -> None:
+        for url in ("/index", "/explore", "/users/author0"):
+            with self.subTest(url=url):
+                with self.assertMaxQueries(self.max_queries_per_page):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+    def test_search_loads_authors_eagerly(self) -> None:
+        self.app.config["SEARCH_BACKEND"] = "elasticsearch"
+        ids = list(db.session.scalars(sa.select(Post.id)))
+        with mock.patch.object(es_service, "query_index_cursor",
+                               return_value=(ids, len(ids), None, None)):
+            with self.assertMaxQueries(self.max_queries_per_page):
+                response = self.client.get("/search?q=post")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"author19", response.data)
+
+    def test_search_suggestions(self) -> None:
+        db.session.add(Post(body="typeahead completes words", author=self.user))
+        db.session.commit()
+
+        response = self.client.get("/search/suggest?q=auth")
+        self.assertEqual([u["username"] for u in response.json["users"]],
+                         ["author0", "author1", "author10", "author11", "author12"])
+        self.assertEqual(len(response.json["posts"]), 5)
+
+        response = self.client.get("/search/suggest?q=typeahead%20compl")
+        self.assertEqual([p["body"] for p in response.json["posts"]],
+                         ["typeahead completes words"])
+
+        # Only the shared index generation is read.
+        with self.assertMaxQueries(1):
+            self.client.get("/search/suggest?q=typeahead%20compl")
+        # Another worker's commit: the post and its index entry, then the bump.
+        with db.engine.begin() as connection:
+            post_id = connection.execute(sa.insert(Post.__table__).values(
+                body="typeahead completion", user_id=self.user.id,
+                timestamp=datetime.now(timezone.utc))).inserted_primary_key[0]
+            db_search_service.apply(connection, [{
+                "_index": Post.get_index_name(), "_id": post_id,
+                "_source": {"body": "typeahead completion"}}])
+        response = self.client.get("/search/suggest?q=typeahead%20compl")
+        self.assertEqual(len(response.json["posts"]), 1)
+        with db.engine.begin() as connection:
+            bump_generations(connection, [Post.get_index_name()])
+        response = self.client.get("/search/suggest?q=typeahead%20compl")
+        self.assertEqual(len(response.json["posts"]), 2)
+
+        self.app.config["SEARCH_BACKEND"] = "inverted"
+        self.app.config["SEARCH_INDEX_DIR"] = tempfile.mkdtemp()
+        inverted_index_service.init_app(self.app)
+        Post.reindex()
+        self.assertEqual([p.body for p in Post.suggest("typeahead completi", 5)],
+                         ["typeahead completion"])
+        self.assertEqual(len(Post.suggest("post fro", 5)), 5)
+
+    def test_server_timing_header(self) -> None:
+        app = create_app("tests.InstrumentedTestConfig")
+        with app.app_context():
+            response = app.test_client().get("/auth/login")
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response.headers["Server-Timing"],
+                         r'^db;dur=[\d.]+;desc="\d+ queries", template;dur=[\d.]+')
+
+    def test_metrics_endpoint(self) -> None:
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+
+        app = create_app("tests.MetricsTestConfig")
+        client = app.test_client()
+        with app.app_context():
+            db.create_all()
+            client.get("/auth/login")
+            self.assertEqual(client.get("/metrics").status_code, 401)
+            response = client.get("/metrics", headers={"Authorization": "Bearer scraper"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'blog_request_duration_seconds_count{blueprint="auth",'
+                      b'endpoint="auth.login",method="GET",status="200"}',
+                      response.data)
+
+    def test_slow_query_log(self) -> None:
+        app = create_app("tests.SlowQueryTestConfig")
+        with app.app_context():
+            db.create_all()
+            db.session.scalars(sa.select(Post).where(Post.user_id == 1)).all()
+            db.session.scalar(sa.select(User).where(User.email == "john@example.com"))
+            db.session.remove()
+        offenders = summarize_slow_queries(app.config["SLOW_QUERY_LOG"], limit=100)
+        select = next(o for o in offenders if o["statement"].startswith("SELECT post"))
+        self.assertEqual(select["count"], 1)
+        self.assertIn("ix_post_user_id", " ".join(select["plan"]))
+
+        with open(app.config["SLOW_QUERY_LOG"]) as f:
+            log = f.read()
+        self.assertIn('"parameters": "[redacted]"', log)
+        self.assertNotIn("john@example.com", log)
+
+    def test_user_loader_is_cached(self) -> None:
+        self.user.set_password('secret')
+        db.session.commit()
+        user_id = str(self.user.id)
+        load_user(user_id)
+        db.session.remove()
+
+        with self.assertMaxQueries(0):
+            user = load_user(user_id)
+        self.assertEqual(user.username, 'john')
+        with self.assertMaxQueries(1):
+            self.assertTrue(user.check_password('secret'))
+
+        user.username = 'johnny'
+        db.session.commit()
+        db.session.remove()
+        self.assertEqual(load_user(user_id).username, 'johnny')
+
+    def test_last_seen_is_buffered(self) -> None:
+        last_seen_buffer.flush()
+        an_hour_ago = datetime.now(timezone.utc) - timedelta(hours=1)
+        self.user.last_seen = an_hour_ago
+        db.session.commit()
+
+        with self.assertMaxQueries(self.max_queries_per_page) as statements:
+            self.client.get("/explore")
+            self.client.get("/explore")
+        self.assertFalse(any(s.startswith("UPDATE user") for s in statements))
+
+        self.assertEqual(last_seen_buffer.flush(), 1)
+        db.session.expire_all()
+        self.assertGreater(self.user.last_seen, an_hour_ago.replace(tzinfo=None))
+
+
+class TranslationCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.app = create_app("tests.TranslatorTestConfig")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self) -> None:
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    @staticmethod
+    def translator_response(text: str, status_code: int = 200) -> mock.Mock:
+        return mock.Mock(status_code=status_code,
+                         json=lambda: [{"translations": [{"text": text}]}])
+
+    def test_translations_are_shared_and_failures_not_cached(self) -> None:
+        with mock.patch.object(translator.session, "post",
+                        return_value=self.translator_response("", 500)) as post:
+            with self.app.test_request_context():
+                self.assertEqual(translate("hello", "en", "uk"),
+                                 "Error: the translation service failed.")
+            post.return_value = self.translator_response("привіт")
+            self.assertEqual(translate("hello", "en", "uk"), "привіт")
+            self.assertEqual(translate("hello", "en", "uk"), "привіт")
+        self.assertEqual(post.call_count, 2)
+        self.assertEqual(db.session.scalar(
+            sa.select(sa.func.count()).select_from(translation_cache)), 1)
+
+        db.session.execute(sa.update(translation_cache).values(
+            expires_at=datetime.now(timezone.utc) - timedelta(seconds=1)))
+        db.session.commit()
+        with mock.patch.object(translator.session, "post",
+                        return_value=self.translator_response("привіт!")) as post:
+            self.assertEqual(translate("hello", "en", "uk"), "привіт!")
+        post.assert_called_once()
+
+    def test_cache_write_failure_still_returns_translation(self) -> None:
+        with mock.patch.object(translator.session, "post",
+                               return_value=self.translator_response("привіт")), \
+                mock.patch("app.translate.store_translations",
+                           side_effect=sa.exc.IntegrityError("INSERT", {}, Exception())):
+            self.assertEqual(translate("hello", "en", "uk"), "привіт")
+
+        with mock.patch.object(translator.session, "post",
+                               return_value=self.translator_response("привіт!")):
+            translate("hello", "en", "uk")
+        with mock.patch("app.translate.random.randrange", return_value=PRUNE_EVERY):
+            store_translations({translation_key("hello", "en", "uk"): "вітаю"})
+        self.assertEqual(translate("hello", "en", "uk"), "вітаю")
+        self.assertEqual(db.session.scalar(
+            sa.select(sa.func.count()).select_from(translation_cache)), 1)
+
+    def test_batch_translation_makes_one_request_per_source_language(self) -> None:
+        def post(url, params, headers, json, timeout):
+            return mock.Mock(status_code=200, json=lambda: [
+                {"translations": [{"text": f"{params['from']}:{item['Text']}"}]}
+                for item in json
+            ])
+
+        with mock.patch.object(translator.session, "post", side_effect=post) as upstream:
+            self.assertEqual(translate("cached", "de", "uk"), "de:cached")
+            upstream.reset_mock()
+            translations = translate_batch(
+                [("one", "de"), ("cached", "de"), ("two", "de"), ("three", "en")], "uk")
+        self.assertEqual(translations, ["de:one", "de:cached", "de:two", "en:three"])
+        self.assertEqual(upstream.call_count, 2)
+        self.assertEqual(upstream.call_args_list[0].kwargs["json"],
+                         [{"Text": "one"}, {"Text": "two"}])
+
+    def test_translate_endpoint_batch(self) -> None:
+        user = User(username="john", email="john@example.com")
+        db.session.add(user)
+        db.session.commit()
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = str(user.id)
+            session["_fresh"] = True
+
+        responses = [self.translator_response("", 500),
+                     mock.Mock(status_code=200, json=lambda: [
+                         {"translations": [{"text": "привіт"}]},
+                         {"translations": [{"text": "світ"}]}])]
+        with mock.patch.object(translator.session, "post", side_effect=responses) as post:
+            response = client.post("/translate", json={
+                "items": [{"id": "translation1", "text": "hallo", "source_language": "de"},
+                          {"id": "translation2", "text": "hello", "source_language": "en"},
+                          {"id": "translation3", "text": "world", "source_language": "en"}],
+                "dest_language": "uk"
+            })
+        self.assertEqual(post.call_count, 2)
+        self.assertEqual(response.get_json()["items"], [
+            {"id": "translation1", "text": "Error: the translation service failed."},
+            {"id": "translation2", "text": "привіт"},
+            {"id": "translation3", "text": "світ"},
+        ])
+
+    def test_translate_endpoint_rejects_malformed_batch(self) -> None:
+        user = User(username="john", email="john@example.com")
+        db.session.add(user)
+        db.session.commit()
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = str(user.id)
+            session["_fresh"] = True
+
+        item = {"id": "translation1", "text": "hallo", "source_language": "de"}
+        payloads = [
+            ["hallo"],
+            {"items": "hallo", "dest_language": "uk"},
+            {"items": [item]},
+            {"items": ["hallo"], "dest_language": "uk"},
+            {"items": [{"id": "translation1", "text": "hallo"}], "dest_language": "uk"},
+            {"items": [{**item, "text": None}], "dest_language": "uk"},
+        ]
+        with mock.patch.object(translator.session, "post") as post:
+            for payload in payloads:
+                with self.subTest(payload=payload):
+                    self.assertEqual(client.post("/translate", json=payload).status_code, 400)
+        post.assert_not_called()
+
+    def test_posts_are_pretranslated_after_commit(self) -> None:
+        def post(url, params, headers, json, timeout):
+            return mock.Mock(status_code=200, json=lambda: [
+                {"translations": [{"text": f"{params['to']}:{item['Text']}"}]}
+                for item in json
+            ])
+
+        user = User(username="john", email="john@example.com")
+        with mock.patch.object(translator.session, "post", side_effect=post) as upstream:
+            db.session.add_all([
+                Post(body="hallo", author=user, language="de"),
+                Post(body="welt", author=user, language="de"),
+                Post(body="привіт", author=user, language="uk"),
+                Post(body="unknown", author=user, language=""),
+            ])
+            db.session.commit()
+        self.assertEqual(upstream.call_count, 3)
+        self.assertEqual(
+            db.session.execute(
+                sa.select(PostTranslation.language, PostTranslation.body)
+                .order_by(PostTranslation.post_id, PostTranslation.language)
+            ).all(),
+            [("en", "en:hallo"), ("uk", "uk:hallo"), ("en", "en:welt"),
+             ("uk", "uk:welt"), ("en", "en:привіт")]
+        )
+
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = str(user.id)
+            session["_fresh"] = True
+        response = client.get("/explore", headers={"Accept-Language": "en"})
+        self.assertIn("en:привіт", response.get_data(as_text=True))
+        self.assertNotIn(b'class="translation"', response.data)
+
+        db.session.execute(sa.delete(PostTranslation.__table__))
+        db.session.commit()
+        with mock.patch.object(translator.session, "post", side_effect=post) as upstream:
+            result = self.app.test_cli_runner().invoke(args=["translate", "posts"])
+        self.assertIn("Stored 5 translation(s) for 3 post(s).", result.output)
+        upstream.assert_not_called()
+
+    def test_language_is_detected_after_commit(self) -> None:
+        self.app.config["WTF_CSRF_ENABLED"] = False
+        user = User(username="john", email="john@example.com")
+        db.session.add(user)
+        db.session.commit()
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = str(user.id)
+            session["_fresh"] = True
+
+        def post(url, params, headers, json, timeout):
+            return mock.Mock(status_code=200, json=lambda: [
+                {"translations": [{"text": "The weather is nice today"}]}])
+
+        with mock.patch("app.language_detection.detect", wraps=detect) as detector, \
+                mock.patch.object(translator.session, "post", side_effect=post) as upstream:
+            response = client.post("/index", data={"post": "Сьогодні чудова погода"})
+            self.assertEqual(response.status_code, 302)
+            detector.assert_called_once()
+        post = db.session.scalar(sa.select(Post))
+        self.assertEqual(post.language, "uk")
+        self.assertEqual(post.translated_body("en"), "The weather is nice today")
+        self.assertEqual(upstream.call_args.kwargs["params"]["from"], "uk")
+
+    def test_concurrent_translations_make_one_upstream_call(self) -> None:
+        release = threading.Event()
+        results = []
+
+        def slow_post(*args, **kwargs):
+            release.wait(5)
+            return self.translator_response("привіт")
+
+        def worker() -> None:
+            with self.app.app_context():
+                results.append(translate("hello", "en", "uk"))
+
+        with mock.patch.object(translator.session, "post", side_effect=slow_post) as post:
+            threads = [threading.Thread(target=worker) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            while post.call_count == 0:
+                threading.Event().wait(0.01)
+            threading.Event().wait(0.05)
+            release.set()
+            for thread in threads:
+                thread.join()
+        post.assert_called_once()
+        self.assertEqual(results, ["привіт"] * 4)
+
+
+class StubTranslatorHandler(BaseHTTPRequestHandler):
+    """Answers with the next ``(status, delay)`` of ``server.script``, then 200s."""
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self) -> None:
+        texts = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append(self.client_address)
+        status, delay = self.server.script.pop(0) if self.server.script else (200, 0)
+        time.sleep(delay)
+        body = json.dumps([
+            {"translations": [{"text": text["Text"].upper()}]} for text in texts
+        ]).encode("utf-8") if status == 200 else b"{}"
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client timed out first
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+class TranslatorClientCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubTranslatorHandler)
+        self.server.daemon_threads = True
+        self.server.requests = []
+        self.server.script = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.app = create_app("tests.TranslatorTestConfig")
+        self.app.config.update(
+            MS_TRANSLATOR_URL=f"http://127.0.0.1:{self.server.server_port}/translate",
+            TRANSLATOR_READ_TIMEOUT=0.2,
+            TRANSLATOR_MAX_RETRIES=1,
+            TRANSLATOR_RETRY_BACKOFF=0,
+            TRANSLATOR_BREAKER_THRESHOLD=2,
+            TRANSLATOR_BREAKER_COOLDOWN=60
+        )
+        translator.init_app(self.app)
+        self.app_context = self.app.test_request_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self) -> None:
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        translator.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connections_are_kept_alive(self) -> None:
+        self.assertEqual(translate("hello", "en", "uk"), "HELLO")
+        self.assertEqual(translate("world", "en", "uk"), "WORLD")
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.server.requests[0], self.server.requests[1])
+
+    def test_timeouts_and_unavailable_responses_are_retried(self) -> None:
+        self.server.script = [(200, 1)]
+        self.assertEqual(translate("slow", "en", "uk"), "SLOW")
+        self.server.script = [(503, 0)]
+        self.assertEqual(translate("busy", "en", "uk"), "BUSY")
+        self.assertEqual(len(self.server.requests), 4)
+
+        self.server.script = [(400, 0)]
+        self.assertEqual(translate("bad", "en", "uk"),
+                         "Error: the translation service failed.")
+        self.assertEqual(len(self.server.requests), 5)
+        self.assertFalse(translator.breaker.is_open)
+
+    def test_circuit_breaker_fails_fast_until_a_probe_succeeds(self) -> None:
+        self.server.script = [(503, 0)] * 4
+        for text in ("one", "two"):
+            self.assertEqual(translate(text, "en", "uk"),
+                             "Error: the translation service failed.")
+        self.assertTrue(translator.breaker.is_open)
+        self.assertEqual(len(self.server.requests), 4)
+
+        self.assertEqual(translate("three", "en", "uk"),
+                         "Error: the translation service failed.")
+        self.assertEqual(len(self.server.requests), 4)
+
+        translator.breaker.cooldown = 0
+        self.assertEqual(translate("three", "en", "uk"), "THREE")
+        self.assertFalse(translator.breaker.is_open)
+        self.assertEqual(len(self.server.requests), 5)
+
+    def test_probe_answered_with_client_error_closes_breaker(self) -> None:
+        self.server.script = [(503, 0)] * 4 + [(400, 0)]
+        for text in ("one", "two"):
+            translate(text, "en", "uk")
+        self.assertTrue(translator.breaker.is_open)
+
+        translator.breaker.cooldown = 0
+        self.assertEqual(translate("three", "en", "uk"),
+                         "Error: the translation service failed.")
+        self.assertFalse(translator.breaker.is_open)
+        self.assertEqual(translate("four", "en", "uk"), "FOUR")
+        self.assertEqual(len(self.server.requests), 6)
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)